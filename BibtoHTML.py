@@ -4,39 +4,246 @@
 A script to format a bibtex database as a simple
 list of publications in HTML, e.g., for your
 group website or CV.
+
+It uses the btcleaner package, so install this
+repository first (pip install .).
 """
 import sys
 import os
+import abc
+import json
+import shutil
+import hashlib
 import argparse
+import tempfile
 # import cgi
 import datetime
 import urllib.parse
 
 try:
-    from titlecase import titlecase
-    import bibtexparser
-    from bibtexparser.bparser import BibTexParser
     # from bibtexparser.bwriter import BibTexWriter
     # from bibtexparser.bibdatabase import BibDatabase
     # from bibtexparser.customization import page_double_hyphen
     # from bibtexparser.latexenc import string_to_latex
     import colorama as cm
     import latexcodec #pylint: disable=unused-import
+    from btcleaner import textnorm
+    from btcleaner.splice import mapfile, iterspans
+    from btcleaner.stream import itemparser, parseitem
 
 except ImportError as msg:
     print("Error importing package: %s" % str(msg))
+    if getattr(msg, 'name', '') and msg.name.startswith('btcleaner'):
+        print("BibtoHTML.py needs btcleaner: run pip install . in the bibtexcleaner repository.")
     sys.exit(1)
 
-    # Setup colors
-cm.init(autoreset=True)
-
+# Bump when the output of an entry changes so old render caches are ignored
+RENDERCACHE_VERSION = 1
+# The sections after the journal articles, in order, and the entry types in each
+SECTIONS = (('books', 'Books'), ('proceedings', 'Proceedings'), ('patents', 'Patents'))
+NONJOURNALS = {'book':'books', 'inbook':'books', 'incollection':'books',
+               'proceedings':'proceedings', 'inproceedings':'proceedings',
+               'conference':'proceedings', 'patent':'patents'}
+RECORDKEYS = ('ID','author','title','journal','pages','volume','year')
+DOIKEYS = ('doi', 'eprint', 'note', 'bdsk-url-1', 'uri', 'bdsk-url-2', 'bdsk-url-3')
+# Fields of books, chapters, proceedings and patents that are listed if they are there
+NONJOURNALKEYS = ('booktitle', 'publisher', 'address', 'pages', 'type', 'number')
+
+
+def parseRecord(record):
+    '''Return the fields of a record, with LaTeX decoded, for a Renderer, or None.
+
+    This is the slow part of formatting an entry and does not depend on
+    the output format, so with --jobs it runs in a pool of workers.
+    '''
+    for key in RECORDKEYS:
+        if key not in record:
+            if 'ENTRYTYPE' in record:
+                if record['ENTRYTYPE'] in ('article','journal'):
+                    print('%sJournal entry missing %s' % (cm.Fore.RED,key))
+                    record[key]=''
 
-class RecordHandler():
+                else:
+                    return __parseNonjournal(record)
+            else:
+                print('%sCannot parse unknown entry.' % cm.Fore.RED)
+                print(record)
+                return None
+
+    return {'section':'journals', 'key':record['ID'], 'year':__parseYear(record),
+            'authors':__parseAuthors(record['author']), 'editors':[],
+            'title':__parseTitle(record), 'url':__findDoi(record),
+            'journal':__cleanLatex(record['journal']),
+            'volume':__cleanLatex(record['volume']),
+            'pages':__cleanLatex(record['pages'])}
+
+def __parseNonjournal(record):
+    '''Return the fields of a book, chapter, proceedings paper or patent, or None'''
+    _section = NONJOURNALS.get(record['ENTRYTYPE'].lower())
+    if _section is None:
+        print('%sSkipping %s %s' % (cm.Fore.YELLOW,record['ENTRYTYPE'],record.get('ID','')))
+        return None
+    for _key in ('title','year'):
+        if _key not in record:
+            print('%s%s entry missing %s' % (cm.Fore.RED,record['ENTRYTYPE'],_key))
+            return None
+    if 'author' not in record and 'editor' not in record:
+        print('%s%s entry missing author' % (cm.Fore.RED,record['ENTRYTYPE']))
+        return None
+
+    fields = {'section':_section, 'key':record.get('ID',''), 'year':__parseYear(record),
+              'authors':__parseAuthors(record['author']) if 'author' in record else [],
+              'editors':__parseAuthors(record['editor']) if 'editor' in record else [],
+              'title':__parseTitle(record), 'url':__findDoi(record)}
+    for _key in NONJOURNALKEYS:
+        if record.get(_key):
+            fields[_key] = __cleanLatex(record[_key])
+    return fields
+
+def __cleanLatex(latex):
+    return textnorm.cleanlatex(r'{}'.format(latex))
+
+def __parseYear(record):
+    try:
+        return int(record['year'])
+    except ValueError:
+        year = datetime.datetime.now().year
+        print("Warning %s is non-numerical year, setting to %s." % (record['year'],year))
+        return year
+
+def __parseTitle(record):
+    return textnorm.titlecase(__cleanLatex(record['title']))
+
+def __parseAuthors(authors):
+    _authorlist = []
+    for _author in (authors.split('and')):
+        _s = __cleanLatex(_author)
+        if ',' not in _s:
+            _s = '%s, %s' % (_s.split(' ')[-1], ' '.join(_s.split(' ')[:-1]))
+        _authorlist.append(_s)
+    return _authorlist
+
+def __findDoi(record):
+    '''Return a link to the DOI of a record, or an empty string'''
+    for key in DOIKEYS:
+        if key in record:
+            if 'doi.org' in record[key].lower():
+                return __parseDoi(record[key])
+            if 'doi' in record[key].lower():
+                return __parseDoi(record[key])
+    return str()
+
+def __parseDoi(doilink):
+    _doi = urllib.parse.urlsplit(doilink.strip())
+    if not _doi.netloc:
+        _url = "dx.doi.org"
+    else:
+        _url = _doi.netloc
+    return urllib.parse.urlunsplit(['http',
+                                    _url,
+                                    _doi.path,
+                                    '',''])
+    #if doi[:4].lower() != 'http':
+    #    return 'http://'+doi
+    #else:
+    #    return doi
+
+
+class Renderer(abc.ABC):
+    '''Turns the fields of entries (see parseRecord) into one output format.
+
+    entry() renders one entry, section() the entries of one year and
+    document() yields the whole output one piece at a time from
+    (section, title, chunks) triples, where chunks are what section()
+    returned and title is None for the journal articles. RecordHandler
+    keeps what entry() and section() return in the render cache.
+    '''
 
-    recordkeys = ('ID','author','title','journal','pages','volume','year')
-    doikeys = ('doi', 'eprint', 'note', 'bdsk-url-1', 'uri', 'bdsk-url-2', 'bdsk-url-3')
     def __init__(self,_opts):
         self.opts = _opts
+
+    @abc.abstractmethod
+    def entry(self,fields):
+        '''Return the rendered entry made of fields'''
+
+    @abc.abstractmethod
+    def section(self,year,entries):
+        '''Return the rendered entries of one year'''
+
+    @abc.abstractmethod
+    def document(self,sections):
+        '''Yield the whole output from (section, title, chunks) triples'''
+
+
+class MarkupRenderer(Renderer):
+    '''Writes entries as citations; subclasses choose the markup'''
+
+    bold = ('','')
+    italics = ('','')
+    normal = ('','')
+
+    def link(self,url,text):
+        return text
+
+    def escape(self,text):
+        return text
+
+    def authors(self,names):
+        _authorlist = []
+        for _s in names:
+            _e = self.escape(_s)
+            if self.opts.boldname and (self.opts.boldname in _s):
+                _e = '%s%s%s' % (self.bold[0],_e,self.bold[1])
+            _authorlist.append(_e)
+        return "%s%s%s" % (self.normal[0], '; '.join(_authorlist), self.normal[1])
+
+    def entry(self,fields):
+        clean_title = self.escape(fields['title'])
+        if fields['url']:
+            clean_title = self.link(fields['url'],clean_title)
+        clean_year = '%s%s%s' % (self.bold[0],fields['year'],self.bold[1])
+
+        if fields['section'] == 'journals':
+            clean_authors = self.authors(fields['authors'])
+            clean_journal = '%s%s%s' % (self.italics[0],self.escape(fields['journal']),self.italics[1])
+            clean_volume = '%s%s%s' % (self.italics[0],self.escape(fields['volume']),self.italics[1])
+            return '%s %s. %s %s, %s, %s' % (clean_authors,
+                                clean_title, clean_journal,
+                                clean_year, clean_volume, self.escape(fields['pages']))
+
+        if fields['authors']:
+            clean_authors = self.authors(fields['authors'])
+        else:
+            clean_authors = '%s, Eds.' % self.authors(fields['editors'])
+        if fields['section'] == 'patents':
+            # e.g. Doe, J. Title. US Patent 1,234,567, 2020
+            _number = ' '.join(self.escape(fields[_k]) for _k in ('type','number') if _k in fields)
+            return '%s %s. %s' % (clean_authors, clean_title,
+                                  ', '.join(_p for _p in (_number, clean_year) if _p))
+
+        # e.g. Doe, J. Title. In Book; Roe, R., Eds.; Publisher: City, 2020; pp 1-10
+        if 'booktitle' in fields:
+            _formatted = '%s %s. In %s%s%s' % (clean_authors, clean_title, self.italics[0],
+                                               self.escape(fields['booktitle']), self.italics[1])
+            if fields['editors'] and fields['authors']:
+                _formatted += '; %s, Eds.' % self.authors(fields['editors'])
+        else:
+            _formatted = '%s %s%s%s' % (clean_authors, self.italics[0], clean_title,
+                                        self.italics[1])
+        _publisher = ': '.join(self.escape(fields[_k]) for _k in ('publisher','address')
+                               if _k in fields)
+        _formatted += '; %s, %s' % (_publisher, clean_year) if _publisher \
+            else ', %s' % clean_year
+        if 'pages' in fields:
+            _formatted += '; pp %s' % self.escape(fields['pages'])
+        return _formatted
+
+
+class HTMLRenderer(MarkupRenderer):
+    '''An ordered list of journal articles with a heading for each year, then the other sections'''
+
+    def __init__(self,_opts):
+        super().__init__(_opts)
         if self.opts.strong:
             self.bold=('<strong>','</strong>')
         elif self.opts.span:
@@ -57,146 +264,231 @@ class RecordHandler():
             self.heading=('<h3>','</h3>')
         else:
             self.heading=self.bold
-
-        self.formatted = {'journals':{},'books':{},'patents':{}}
+        self.sep = '\n' if self.opts.linebreaks else ''
 
 #<p>Wan, W. Brad; Chiechi, Ryan C; Weakley, T.J.R.; Haley, M.M. <A href="http://doi.org/10.1002/1099-0690(200109)2001:18%3C3485::AID-EJOC3485%3E3.0.CO;2-I" target="_blank">Synthesis and Spectroscopic Studies of Expanded Planar Dehydrotribenzo[n]annulenes Containing One or Two Isolated Alkene Units</A>. <i>Eur. J. Org. Chem.</i> <b>2001</b>, <i>2001</i>, 3485-3490</p></li><li><p>Bell, M.L.; Chiechi, Ryan C; Johnson, C.A.; Kimball, D.B.; Matzger, A.J.; Wan, W. Brad; Weakley, T.J.R.; Haley, M.M. <A href="http://dx.doi.org/10.1016/S0040-4020(01)00229-0" target="_blank">A Versatile Synthetic Route to Dehydrobenzoannulenes via in Situ Generation of Reactive Alkynes</A>. <i>Tetrahedron</i> <b>2001</b>, <i>57</i>, 3507-3520</p>
 # <h3>2018</h3>
-# <p class="c2"><span>Jia, C.; Famili, M.; Carlotti, M.; Liu, Y.; Wang, P.; Grace, I. M.; Feng, Z.; Wang, Y.; Zhao, Z.; Ding, M.; Xu, X.; Wang, C.; Lee, S.-J.; Huang, Y.; Chiechi, R. C.; Lambert, C. J.; Duan, X. 
+# <p class="c2"><span>Jia, C.; Famili, M.; Carlotti, M.; Liu, Y.; Wang, P.; Grace, I. M.; Feng, Z.; Wang, Y.; Zhao, Z.; Ding, M.; Xu, X.; Wang, C.; Lee, S.-J.; Huang, Y.; Chiechi, R. C.; Lambert, C. J.; Duan, X.
 # </span><span class="c1">Sci. Adv.</span><span>&nbsp;</span><span class="c3">2018</span><span>, </span><span class="c1">4</span><span class="c0">&nbsp;(10), eaat8237.</span></p><br>
-    def outputHTML(self):
-        html=[]
-        years = list(self.formatted['journals'].keys())
-        years.sort(reverse=True)
-
-        html.append('<ol>')
-        for _year in years:
-            html.append('%s%s%s' % (self.heading[0],_year,self.heading[1]))
-            for _pub in self.formatted['journals'][_year]:
-                html.append('<li>')
-                html.append('<p>%s</p>' % _pub)
-                html.append('</li>')
-        html.append('</ol>')
-
-        if self.opts.linebreaks:
-            return '\n'.join(html)
-        else:
-            return ''.join(html)
-
-    # def outputFancyHTML(self):
-    #     html=[]
-    #     years = list(self.formatted['journals'].keys())
-    #     years.sort(reverse=True)
-
-    #     html.append('<ol>')
-    #     for _year in years:
-    #         html.append('<h3>%s</h3>' % _year)
-    #         for _pub in self.formatted['journals'][_year]:
-    #             html.append('<li>')
-    #             html.append('<p>%s</p>' % _pub)
-    #             html.append('</li>')
-    #     html.append('</ol>')
-
-    #     if self.opts.linebreaks:
-    #         return '\n'.join(html)
-    #     else:
-    #         return ''.join(html)
-
-    def handle_record(self,record):
-        _formatted = str()
-        for key in self.recordkeys:
-            if key not in record:
-                if 'ENTRYTYPE' in record:
-                    if record['ENTRYTYPE'] in ('article','journal'):
-                        print('%sJournal entry missing %s' % (cm.Fore.RED,key))
-                        record[key]=''
-
-                    else:
-                        self.__parseNonjournal(record)
-                        return False
-                else:
-                    print('%sCannot parse unknown entry.' % cm.Fore.RED)
-                    print(record)
-                    return False
-
-        try:
-            year = int(record['year'])
-        except ValueError:
-            year = datetime.datetime.now().year
-            print("Warning %s is non-numerical year, setting to %s." % (record['year'],year))
-        clean_title = titlecase(self.__cleanLatex(record['title']))
-        clean_doi = str()
-
-
-        for key in self.doikeys:
-            if key in record:
-                if 'doi.org' in record[key].lower():
-                    clean_doi = self.__parseDoi(record[key])
-                    break
-                if 'doi' in record[key].lower():
-                    clean_doi = self.__parseDoi(record[key])
-                    break
-
-        if clean_doi:
-            clean_title = '<A href="%s" target="_blank">%s</A>' % (clean_doi,clean_title)
-
-        #str(bytes(_author.strip(), encoding='latex'),encoding='latin-1')
-        clean_authors = self.__parseAuthors(record['author'])
-        clean_journal = '%s%s%s' % (self.italics[0],self.__cleanLatex(record['journal']),self.italics[1])
-        clean_pages = self.__cleanLatex(record['pages'])
-        clean_volume = '%s%s%s' % (self.italics[0],self.__cleanLatex(record['volume']),self.italics[1])
-        clean_year = '%s%s%s' % (self.bold[0],self.__cleanLatex(year),self.bold[1])
-
-        _formatted = '%s %s. %s %s, %s, %s' % (clean_authors,
-                                clean_title, clean_journal,
-                                clean_year, clean_volume, clean_pages)
+    def link(self,url,text):
+        return '<A href="%s" target="_blank">%s</A>' % (url,text)
+
+    def section(self,year,entries):
+        html = ['%s%s%s' % (self.heading[0],year,self.heading[1])]
+        for _pub in entries:
+            html.append('<li>')
+            html.append('<p>%s</p>' % _pub)
+            html.append('</li>')
+        return self.sep.join(html)
+
+    def document(self,sections):
+        for _section, _title, _chunks in sections:
+            if _title is None:
+                yield '<ol>'
+            else:
+                yield '%s%s%s%s%s<ol>' % (self.sep, self.heading[0], _title, self.heading[1], self.sep)
+            for _chunk in _chunks:
+                yield self.sep + _chunk
+            yield self.sep + '</ol>'
+
+
+class MarkdownRenderer(MarkupRenderer):
+    '''A numbered list under a heading for each year, e.g. for a static site generator'''
+
+    bold = ('**','**')
+    italics = ('*','*')
+    # Characters that would otherwise be taken for Markdown
+    special = str.maketrans({_c:'\\'+_c for _c in '\\`*_[]'})
+
+    def link(self,url,text):
+        return '[%s](%s)' % (text,url)
+
+    def escape(self,text):
+        return str(text).translate(self.special)
+
+    def section(self,year,entries):
+        return '### %s\n\n%s\n' % (year, '\n'.join('1. %s' % _pub for _pub in entries))
+
+    def document(self,sections):
+        for _section, _title, _chunks in sections:
+            if _title is not None:
+                yield '## %s\n\n' % _title
+            for _chunk in _chunks:
+                yield _chunk + '\n'
+
+
+class JSONRenderer(Renderer):
+    '''A JSON list of the fields of every entry, in the order of the other formats'''
+
+    def entry(self,fields):
+        return json.dumps(fields, ensure_ascii=False, sort_keys=True)
+
+    def section(self,year,entries):
+        return ',\n'.join(entries)
+
+    def document(self,sections):
+        _open = '['
+        for _section, _title, _chunks in sections:
+            for _chunk in _chunks:
+                yield '%s\n%s' % (_open, _chunk)
+                _open = ','
+        yield '%s\n]\n' % ('[' if _open == '[' else '')
+
+RENDERERS = {'html':HTMLRenderer, 'markdown':MarkdownRenderer, 'json':JSONRenderer}
+
+
+class RenderCache():
+    '''The entries and year sections rendered by the last run, kept next to the output file.
+
+    Entries are keyed by a hash of their text in the bib file (and of the
+    @string macros before them), so an entry that did not change is
+    neither parsed nor formatted again, and a year section whose entries
+    did not change is written out as it was. The cache is thrown away
+    when the output format or its options change.
+    '''
+
+    def __init__(self, path, opts, load=True):
+        self.path = path
+        self.signature = [RENDERCACHE_VERSION, opts.format, opts.boldname, opts.strong,
+                          opts.em, opts.span, opts.linebreaks]
+        self.entries = {}
+        self.sections = {}
+        if load and os.path.exists(path):
+            try:
+                with open(path) as fh:
+                    cached = json.load(fh)
+            except (OSError, ValueError) as msg:
+                print('%sIgnoring render cache %s: %s' % (cm.Fore.YELLOW, path, str(msg)))
+                return
+            if cached.get('signature') == self.signature:
+                self.entries = cached['entries']
+                self.sections = cached['sections']
+
+    def save(self, entries, sections):
+        '''Keep only what this run rendered, for the next run'''
+        out = tempfile.NamedTemporaryFile('w', dir=os.path.dirname(os.path.abspath(self.path)),
+                                          delete=False, suffix='.tmp')
+        with out:
+            json.dump({'signature':self.signature, 'entries':entries, 'sections':sections}, out)
+        os.replace(out.name, self.path)
 
-        if year not in self.formatted['journals']:
-            self.formatted['journals'][year]=[_formatted]
-        else:
-            self.formatted['journals'][year].append(_formatted)
-
-    def __cleanLatex(self,latex):
-        _raw = r'{}'.format(latex)
-        for _r in ( ('{',''),('}',''),('--','-')):
-            _raw = _raw.replace(_r[0],_r[1])
-        cleaned= bytes(_raw, encoding='utf8').decode('latex')
-
-        return str(cleaned).strip()
 
-    def __parseAuthors(self,authors):
-        _authorlist = []
-        for _author in (authors.split('and')):
-            _s = self.__cleanLatex(_author)
-            if ',' not in _s:
-                _s = '%s, %s' % (_s.split(' ')[-1], ' '.join(_s.split(' ')[:-1]))
-            if opts.boldname and (opts.boldname in _s):
-                _s = '%s%s%s' % (self.bold[0],_s,self.bold[1])
-            _authorlist.append(_s)
-        return "%s%s%s" % (self.normal[0], '; '.join(_authorlist), self.normal[1])
+class RecordHandler():
 
-    def __parseDoi(self,doilink):
-        _doi = urllib.parse.urlsplit(doilink.strip())
-        if not _doi.netloc:
-            _url = "dx.doi.org"
-        else:
-            _url = _doi.netloc
-        return urllib.parse.urlunsplit(['http',
-                                        _url,
-                                        _doi.path,
-                                        '',''])
-        #if doi[:4].lower() != 'http':
-        #    return 'http://'+doi
-        #else:
-        #    return doi
-
-    def __parseNonjournal(self,record):
-        # TODO: actually parse non-journals
-        print('%sPretending to parse non-journal%s' % (cm.Style.BRIGHT,cm.Style.RESET_ALL))
-        if not self.formatted['books']:
-            self.formatted['books']={'2018':[record]}
+    def __init__(self,_opts,cache=None):
+        self.opts = _opts
+        self.cache = cache
+        self.renderer = RENDERERS[self.opts.format](self.opts)
+        # section -> year -> [(key, entry)] in the order of the bib file; key
+        # is the hash of the entry in the render cache, or None
+        self.formatted = {'journals':{},'books':{},'proceedings':{},'patents':{}}
+        # What this run rendered, to save in the render cache
+        self.rendered = {'entries':{}, 'sections':{}}
+        self.stats = {'n_formatted':0, 'n_reused':0, 'n_sections':0, 'n_sections_rendered':0}
+
+    def output(self):
+        return ''.join(self.iterOutput())
+
+    def iterOutput(self):
+        '''Yield the output one year section at a time, newest first, journals before the rest'''
+        sections = [('journals', None, self.__renderSections('journals'))]
+        for _section, _title in SECTIONS:
+            if self.formatted[_section]:
+                sections.append((_section, _title, self.__renderSections(_section)))
+        return self.renderer.document(sections)
+
+    def writeOutput(self,fh):
+        for _chunk in self.iterOutput():
+            fh.write(_chunk)
+
+    def handle_record(self,record,cachekey=None):
+        '''Format a record and file it under its section and year; return it formatted or False'''
+        return self.__add(parseRecord(record), cachekey)
+
+    def handle_records(self,pending,jobs=1):
+        '''Format parsed (record, cachekey) pairs, in a pool of jobs processes if jobs > 1.
+
+        The entries are filed in the order they are given whichever worker
+        formats them, so the output does not depend on jobs.
+        '''
+        records = [_r for _r, _ in pending]
+        if jobs > 1 and len(records) > 1:
+            # Only needed with --jobs and slow to import
+            from concurrent.futures import ProcessPoolExecutor  #pylint: disable=C0415
+            with ProcessPoolExecutor(jobs) as pool:
+                fields = list(pool.map(parseRecord, records,
+                                       chunksize=max(1, len(records) // (jobs*4))))
         else:
-            self.formatted['books']['2018'].append(record)
+            fields = [parseRecord(_r) for _r in records]
+        for (_, cachekey), _f in zip(pending, fields):
+            self.__add(_f, cachekey)
+
+    def addCached(self,key):
+        '''File the entry with this key from the render cache; return False if it is not there'''
+        if self.cache is None or key not in self.cache.entries:
+            return False
+        _section, _year, _formatted = self.cache.entries[key]
+        self.__file(_section, _year, _formatted, key)
+        self.stats['n_reused'] += 1
+        return True
+
+    def __add(self,fields,cachekey=None):
+        if fields is None:
+            return False
+        _formatted = self.renderer.entry(fields)
+        self.__file(fields['section'], fields['year'], _formatted, cachekey)
+        self.stats['n_formatted'] += 1
+        return _formatted
+
+    def __file(self,section,year,formatted,key=None):
+        self.formatted[section].setdefault(year, []).append((key, formatted))
+        if key is not None:
+            self.rendered['entries'][key] = [section, year, formatted]
+
+    def __renderSections(self,section):
+        '''Yield each year of a section rendered, reusing those whose entries did not change'''
+        for _year in sorted(self.formatted[section], reverse=True):
+            _pubs = self.formatted[section][_year]
+            _name = '%s/%s' % (section, _year)
+            _digest = None
+            if all(_key is not None for _key, _ in _pubs):
+                _digest = hashlib.sha1(' '.join(_key for _key, _ in _pubs).encode()).hexdigest()
+            self.stats['n_sections'] += 1
+            _cached = self.cache.sections.get(_name) if self.cache is not None else None
+            if _digest is not None and _cached is not None and _cached[0] == _digest:
+                _chunk = _cached[1]
+            else:
+                _chunk = self.renderer.section(_year, [_pub for _, _pub in _pubs])
+                self.stats['n_sections_rendered'] += 1
+            if _digest is not None:
+                self.rendered['sections'][_name] = [_digest, _chunk]
+            yield _chunk
+
+def parseBibfile(bibfile,records,jobs=1):
+    '''Hand every entry of bibfile to records, skipping those it has in its render cache.
+
+    Each @item is parsed on its own, in the order of the file; its cache key
+    is a hash of its text and of every @string macro defined before it.
+    The parsed entries are then formatted together, see handle_records.
+    '''
+    bibparser = itemparser()
+    # Patents are not a standard BibTeX type
+    bibparser.ignore_nonstandard_types = False
+    strings = hashlib.sha1()
+    pending = []
+    with mapfile(bibfile) as data:
+        for itemtype, start, end in iterspans(data):
+            text = data[start:end]
+            if itemtype == 'string':
+                strings.update(text)
+                parseitem(bibparser, itemtype, text.decode('utf8'))
+                continue
+            _key = hashlib.sha1(strings.digest() + text).hexdigest()
+            if records.addCached(_key):
+                continue
+            for record in parseitem(bibparser, itemtype, text.decode('utf8')):
+                pending.append((record, _key))
+    records.handle_records(pending, jobs)
 
 # Parse args
 desc = 'Convert a BibTeX database to HTML.'
@@ -209,6 +501,8 @@ parser.add_argument('infile', type=str, nargs=1, default=[],
     help='Bibtex file to parse.')
 parser.add_argument('-b', '--boldname', type=str, default='',
     help='Authors containing this string will be bolded.')
+parser.add_argument('--format', type=str, choices=tuple(RENDERERS), default='html',
+    help='Output format.')
 parser.add_argument('--strong', action="store_true", default=False,
     help='Use <strong> instead of <b>')
 parser.add_argument('--em', action="store_true", default=False,
@@ -218,32 +512,55 @@ parser.add_argument('--span', action="store_true", default=False,
 parser.add_argument('--linebreaks', action="store_true", default=False,
     help='Use linebreaks in HTML output.')
 parser.add_argument('-o', '--out', type=str, default='',
-    help='Write output to html file instead of stdout.')
-
-opts=parser.parse_args()
-if not opts.infile:
-    print('%sI need a bib file to parse!' % cm.Fore.RED)
-    sys.exit()
-elif not os.path.exists(opts.infile[0]):
-    print('%s%s does not exist!' % (cm.Fore.RED,opts.infile[0]))
-
-
-BIBFILE=os.path.abspath(opts.infile[0])
-parser = BibTexParser(common_strings=True)
-records = RecordHandler(opts)
-parser.customization = records.handle_record
-print('%s # # # # %s\n' % (cm.Style.BRIGHT,cm.Style.RESET_ALL) )
-with open(BIBFILE) as fh:
+    help='Write output to html file instead of stdout.\
+    Entries unchanged since the last run are taken from out.cache.json.')
+parser.add_argument('-f', '--full', action="store_true", default=False,
+    help='Format every entry, ignoring the render cache.')
+parser.add_argument('-j', '--jobs', type=int, default=1,
+    help='Format entries in this many processes.')
+
+def main():
+    '''Print or write the HTML of the bib file named on the command line'''
+    opts = parser.parse_args()
+    # Setup colors
+    cm.init(autoreset=True)
+    if not opts.infile:
+        print('%sI need a bib file to parse!' % cm.Fore.RED)
+        return
+    elif not os.path.exists(opts.infile[0]):
+        print('%s%s does not exist!' % (cm.Fore.RED,opts.infile[0]))
+        return
+
+    bibfile=os.path.abspath(opts.infile[0])
+    cache = None
+    if opts.out:
+        cache = RenderCache(opts.out+'.cache.json', opts, load=not opts.full)
+    records = RecordHandler(opts, cache)
+    print('%s # # # # %s\n' % (cm.Style.BRIGHT,cm.Style.RESET_ALL) )
     try:
-        bib_database = bibtexparser.load(fh, parser=parser)
+        parseBibfile(bibfile, records, opts.jobs)
     except KeyError as msg:
         print("Error opening bib file: KeyErorr, %s" % str(msg))
         sys.exit(1)
-print('\n%s # # # # %s' % (cm.Style.BRIGHT,cm.Style.RESET_ALL) )
-
-if opts.out:
-    with open(opts.out, 'w') as fh:
-        fh.write(records.outputHTML())
-else:
-    print('* * * * * * * * * * * * * * * * * * * * * * * * * * *\n')
-    print(records.outputHTML())
+    print('\n%s # # # # %s' % (cm.Style.BRIGHT,cm.Style.RESET_ALL) )
+
+    if opts.out:
+        # Written a year at a time next to the old file, which it then replaces
+        out = tempfile.NamedTemporaryFile('w', dir=os.path.dirname(os.path.abspath(opts.out)),
+                                          delete=False, suffix='.tmp')
+        with out:
+            records.writeOutput(out)
+        if os.path.exists(opts.out):
+            shutil.copymode(opts.out, out.name)
+        os.replace(out.name, opts.out)
+        cache.save(records.rendered['entries'], records.rendered['sections'])
+        print('%sFormatted %s entries and reused %s; rendered %s of %s year sections.' % (
+            cm.Fore.BLUE, records.stats['n_formatted'], records.stats['n_reused'],
+            records.stats['n_sections_rendered'], records.stats['n_sections']))
+    else:
+        print('* * * * * * * * * * * * * * * * * * * * * * * * * * *\n')
+        records.writeOutput(sys.stdout)
+        print('')
+
+if __name__ == '__main__':
+    main()
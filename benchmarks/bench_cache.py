@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+'''Compare load times of the sqlite journal cache against the old whole-file pickle.
+
+Pass one or more JabRef abbreviation lists (e.g. every journal_abbreviations_*.csv
+from abbrv.jabref.org) to benchmark the real corpus, or --synthetic N to
+generate N made-up journals (see synthetic.py).
+
+It then checks that a custom abbreviation answered in one run is used to
+match journals in the next one, cold and through the same Cleaner, rather
+than match results scored before the custom was added. Exits with 1 if
+it is not.
+'''
+
+import sys
+import os
+import time
+import random
+import pickle
+import tempfile
+import argparse
+import contextlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from btcleaner import cache, Cleaner, Decisions  #pylint: disable=E0401,C0413
+import synthetic  #pylint: disable=E0401,C0413
+
+
+def readlists(fns):
+    '''Read full name;abbreviation pairs from JabRef csv files'''
+    journals = {}
+    for _fn in fns:
+        with open(_fn, encoding='utf8') as fh:
+            for _l in fh:
+                _f = _l.strip().split(';')
+                if len(_f) > 1:
+                    journals[_f[0].strip('"')] = _f[1].strip('"')
+    return journals
+
+def checkcustom(tmpdir):
+    '''Return True if a custom answered in one run is matched in the next, cold and warm'''
+    cache.CACHEDIR = os.path.join(tmpdir, 'custom')
+    cache.JCACHE = os.path.join(cache.CACHEDIR, 'journal_abbreviations.db')
+    listfile = os.path.join(tmpdir, 'custom.csv')
+    with open(listfile, 'w', encoding='utf8') as fh:
+        fh.write('Journal of Kittens;J. Kitt.\nJournal of Puppies;J. Pup.\n')
+    bibtex = ''.join('@article{key%d,\n author = {Doe, Jane},\n title = {Title %d},\n'
+                     ' journal = {%s},\n volume = {1},\n pages = {%d},\n year = {2000},\n}\n'
+                     % (i, i, _j, i) for i, _j in enumerate(('Jornal of Foo Bar Baz',
+                                                             'Jornal of Foo Bar Baz.')))
+    answer = {'version':1, 'journals':[{'journal':'Jornal of Foo Bar Baz',
+                                        'suggestion':'J. Kitt.', 'score':0.5,
+                                        'replace':'J. Foo'}], 'duplicates':[]}
+    with contextlib.redirect_stdout(None):
+        cleaner = Cleaner([listfile])
+        decisions = Decisions(batch=True)
+        decisions.update(answer)
+        _, records = cleaner.cleanstring(bibtex, decisions)
+        cleaner.save(records)
+        warm, _ = cleaner.cleanstring(bibtex, Decisions(batch=True))
+        cleaner.journals.close()
+        cleaner = Cleaner([listfile])
+        cold, _ = cleaner.cleanstring(bibtex, Decisions(batch=True))
+        cleaner.journals.close()
+    return warm.count('{J. Foo}') == 2 and cold.count('{J. Foo}') == 2
+
+def timeit(func):
+    '''Return (seconds, result) of calling func'''
+    _t = time.perf_counter()
+    _r = func()
+    return time.perf_counter() - _t, _r
+
+def main():
+    '''Run the benchmark'''
+    parser = argparse.ArgumentParser(description=__doc__,
+                formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('lists', nargs='*', help='JabRef abbreviation csv files.')
+    parser.add_argument('--synthetic', type=int, default=100000,
+                        help='Number of journals to make up if no lists are given.')
+    parser.add_argument('--lookups', type=int, default=1000,
+                        help='Number of random lookups to time.')
+    parser.add_argument('--seed', type=int, default=1,
+                        help='Seed for the synthetic data.')
+    opts = parser.parse_args()
+
+    rng = random.Random(opts.seed)
+    journals = readlists(opts.lists) if opts.lists else synthetic.journals(opts.synthetic, rng)
+    keys = rng.sample(list(journals), min(opts.lookups, len(journals)))
+    print('%d journals' % len(journals))
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        pfn = os.path.join(tmpdir, 'journals.cache')
+        sfn = os.path.join(tmpdir, 'journals.db')
+
+        def pickledump():
+            with open(pfn, 'wb') as fh:
+                pickle.dump(journals, fh)
+        def pickleload():
+            with open(pfn, 'rb') as fh:
+                return pickle.load(fh)
+        def sqlitebuild():
+            cache.JournalStore(sfn).addcustom(journals)
+        def sqliteappend():
+            cache.JournalStore(sfn).addcustom({'Journal of Kittens': 'J. Kitt.'})
+
+        results = [('pickle: write all', timeit(pickledump)[0]),
+                   ('sqlite: build', timeit(sqlitebuild)[0]),
+                   ('pickle: rewrite to add one', timeit(pickledump)[0]),
+                   ('sqlite: append one', timeit(sqliteappend)[0])]
+        _t, loaded = timeit(pickleload)
+        results.append(('pickle: load', _t))
+        _t, store = timeit(lambda: cache.JournalStore(sfn))
+        results.append(('sqlite: open', _t))
+        results.append(('pickle: %d lookups' % len(keys),
+                        timeit(lambda: [loaded[_k] for _k in keys])[0]))
+        results.append(('sqlite: %d lookups' % len(keys),
+                        timeit(lambda: [store[_k] for _k in keys])[0]))
+        results.append(('sqlite: iterate all', timeit(lambda: list(store.items()))[0]))
+        store.close()
+        for _name, _t in results:
+            print('%-30s %10.2f ms' % (_name, _t*1000))
+        print('%-30s %10.1f kB' % ('pickle: size', os.path.getsize(pfn)/1024))
+        print('%-30s %10.1f kB' % ('sqlite: size', os.path.getsize(sfn)/1024))
+        if not checkcustom(tmpdir):
+            sys.exit('A custom added in one run was not used to match in the next')
+        print('custom added between runs is matched: ok')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+'''Time duplicate detection on synthetic bibliographies (see synthetic.py).
+
+The grouping used by dedupe.dodupecheck is timed on --entries records;
+the pairwise scan it replaced is timed on --legacy records because it is
+quadratic and would take hours on 100k entries.
+'''
+
+import sys
+import os
+import time
+import random
+import argparse
+import contextlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from bibtexparser.bibdatabase import BibDatabase  #pylint: disable=E0401,C0413
+from btcleaner import dedupe, Decisions  #pylint: disable=E0401,C0413
+import synthetic  #pylint: disable=E0401,C0413
+
+
+def legacygroups(entries):
+    '''The pairwise scan that shipped before dedupe.findgroups, for comparison'''
+    candidates = []
+    dupes = {}
+    for record in entries:
+        try:
+            _p = record['pages'].split('-')[0].strip().strip('-')
+            _j, _v, _id = record['journal'], record['volume'], record['ID']
+            if _p and _v:
+                candidates.append( (_p, _v, _j, _id) )
+        except KeyError:
+            continue
+    while candidates:
+        _e = candidates.pop()
+        for _c in candidates:
+            if _e[0:2] == _c[0:2]:
+                dupes.setdefault(_e[-1], []).append(_c)
+    return dupes
+
+def main():
+    '''Run the benchmark'''
+    parser = argparse.ArgumentParser(description=__doc__,
+                formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--entries', type=int, default=100000,
+                        help='Number of entries for the current implementation.')
+    parser.add_argument('--legacy', type=int, default=5000,
+                        help='Number of entries for the pairwise scan (0 to skip).')
+    parser.add_argument('--duprate', type=float, default=0.02,
+                        help='Fraction of entries that duplicate an earlier one.')
+    parser.add_argument('--journals', type=int, default=500,
+                        help='Number of journals the entries are in.')
+    parser.add_argument('--seed', type=int, default=1,
+                        help='Seed for the synthetic data.')
+    opts = parser.parse_args()
+
+    rng = random.Random(opts.seed)
+    journals = synthetic.journals(opts.journals, rng)
+    for _n, _label in ((opts.legacy, 'pairwise'), (opts.entries, 'grouped')):
+        if not _n:
+            continue
+        bib_database = BibDatabase()
+        bib_database.entries = synthetic.entries(_n, journals, rng, duprate=opts.duprate,
+                                                 missing=0)
+        if _label == 'pairwise':
+            _t = time.perf_counter()
+            legacygroups(bib_database.entries)
+            _t = time.perf_counter() - _t
+            print('%-10s %8d entries %10.3f s' % (_label, _n, _t))
+        # Batch decisions keep every group without asking
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            _t = time.perf_counter()
+            clean = dedupe.dodupecheck(bib_database, Decisions(batch=True))
+            _t = time.perf_counter() - _t
+        print('%-10s %8d entries %10.3f s (%d kept)' % ('grouped', _n, _t, len(clean)))
+
+if __name__ == '__main__':
+    main()
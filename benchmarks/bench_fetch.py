@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+'''Fetch abbreviation lists from a local stand-in for an HTTP server.
+
+The stand-in serves made-up JabRef lists (see synthetic.py) with a delay
+on every response, ETags, conditional GETs and Range requests, gzips the
+response for clients that accept it, and can cut a response off half way
+or answer 503 to test the fetcher. It checks that:
+
+  - fetching the sources at the same time gives the same journals as
+    fetching them one at a time, and times both;
+  - a download that is cut off is resumed with a Range request;
+  - a 503 is retried;
+  - unchanged sources are not downloaded again (304);
+  - with the server gone, the cached copies are kept.
+
+Exits with 1 if any of these fails.
+'''
+
+import sys
+import os
+import io
+import gzip
+import time
+import random
+import hashlib
+import argparse
+import tempfile
+import threading
+import contextlib
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'src'))
+from btcleaner import cache, fetcher  #pylint: disable=E0401,C0413
+import synthetic  #pylint: disable=E0401,C0413
+
+
+class StandIn(BaseHTTPRequestHandler):
+    '''Serve server.files with server.delay before every response'''
+
+    def do_GET(self):  #pylint: disable=C0103
+        '''Answer a GET the way a static file server would'''
+        server = self.server
+        body = server.files.get(self.path)
+        server.log.append((self.path, self.headers.get('Range')))
+        time.sleep(server.delay)
+        if body is None:
+            self.send_error(404)
+            return
+        if server.unavailable.get(self.path, 0):
+            server.unavailable[self.path] -= 1
+            self.send_error(503)
+            return
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            # As a server with compressed copies of its files would
+            body = gzip.compress(body, mtime=0)
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        start = 0
+        _range = self.headers.get('Range', '')
+        if _range.startswith('bytes=') and self.headers.get('If-Range') == etag:
+            start = int(_range[6:].split('-')[0])
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, len(body)-1, len(body)))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(body) - start))
+        self.send_header('ETag', etag)
+        if body is not server.files[self.path]:
+            self.send_header('Content-Encoding', 'gzip')
+        self.end_headers()
+        if server.cutoff.get(self.path, 0):
+            # Send half of it and hang up
+            server.cutoff[self.path] -= 1
+            self.wfile.write(body[start:start + (len(body) - start)//2])
+            self.close_connection = True
+            return
+        self.wfile.write(body[start:])
+
+    def log_message(self, format, *args):  #pylint: disable=W0622
+        '''Keep quiet'''
+
+
+def serve(files, delay):
+    '''Start the stand-in on a free port in a thread and return it'''
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandIn)
+    server.files, server.delay = files, delay
+    server.log, server.cutoff, server.unavailable = [], {}, {}
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def load(urls, cachedir, jobs, refresh=False):
+    '''Return (seconds, dict of the journals) of cache.getcache into cachedir'''
+    cache.CACHEDIR = cachedir
+    cache.JCACHE = os.path.join(cachedir, 'journal_abbreviations.db')
+    fetcher.JOBS = jobs
+    _t = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        journals = cache.getcache(urls, refresh=refresh)
+    seconds = time.perf_counter() - _t
+    result = dict(journals.items())
+    journals.close()
+    return seconds, result
+
+def check(ok, what):
+    '''Print whether a check passed and return ok'''
+    print('%-48s %s' % (what, 'ok' if ok else 'FAILED'))
+    return ok
+
+def main():
+    '''Run the benchmark'''
+    parser = argparse.ArgumentParser(description=__doc__,
+                formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sources', type=int, default=8,
+                        help='Number of abbreviation lists to serve.')
+    parser.add_argument('--journals', type=int, default=5000,
+                        help='Number of journals in each list.')
+    parser.add_argument('--delay', type=float, default=0.2,
+                        help='Seconds the stand-in waits before every response.')
+    parser.add_argument('--jobs', type=int, default=4,
+                        help='Sources to fetch at the same time.')
+    parser.add_argument('--seed', type=int, default=1,
+                        help='Seed for the synthetic data.')
+    opts = parser.parse_args()
+
+    rng = random.Random(opts.seed)
+    files = {'/list%d.csv' % _i: ('\n'.join(synthetic.abbreviationlines(
+                 synthetic.journals(opts.journals, rng), rng)) + '\n').encode('utf8')
+             for _i in range(opts.sources)}
+    server = serve(files, opts.delay)
+    urls = ['http://127.0.0.1:%d%s' % (server.server_address[1], _p) for _p in sorted(files)]
+    fetcher.BACKOFF = 0.01
+    passed = True
+    with tempfile.TemporaryDirectory() as tmpdir:
+        serial, expected = load(urls, os.path.join(tmpdir, 'serial'), 1)
+        concurrent, journals = load(urls, os.path.join(tmpdir, 'concurrent'), opts.jobs)
+        print('%d sources of %d journals, %.2f s delay per response' % (
+            len(urls), opts.journals, opts.delay))
+        print('%-12s %8.2f s' % ('one by one', serial))
+        print('%-12s %8.2f s  %.1fx with %d jobs' % ('concurrent', concurrent,
+                                                    serial/concurrent, opts.jobs))
+        passed &= check(journals == expected and len(expected) > 0,
+                        'same journals either way')
+
+        server.log.clear()
+        server.cutoff[sorted(files)[0]] = 1
+        server.unavailable[sorted(files)[1]] = 1
+        _, journals = load(urls, os.path.join(tmpdir, 'faults'), opts.jobs)
+        passed &= check(journals == expected, 'same journals with faults')
+        passed &= check(any(_p == sorted(files)[0] and _r for _p, _r in server.log),
+                        'cut off download resumed with a Range request')
+        passed &= check(sum(_p == sorted(files)[1] for _p, _ in server.log) == 2,
+                        '503 retried once')
+
+        server.log.clear()
+        _, journals = load(urls, os.path.join(tmpdir, 'faults'), opts.jobs, refresh=True)
+        passed &= check(journals == expected and len(server.log) == len(urls),
+                        'unchanged sources not downloaded again')
+
+        server.shutdown()
+        server.server_close()
+        _t = time.perf_counter()
+        _, journals = load(urls, os.path.join(tmpdir, 'faults'), opts.jobs, refresh=True)
+        passed &= check(journals == expected, 'offline: cached copies kept (%.2f s)'
+                        % (time.perf_counter() - _t))
+        downloads = os.path.join(tmpdir, 'faults', 'bibtexcleaner-downloads')
+        passed &= check(not os.listdir(downloads), 'no downloads left behind')
+    if not passed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
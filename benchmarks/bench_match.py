@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+'''Compare scoring journals one at a time with JournalMatcher.match and in bulk with matchmany.
+
+The journal strings are made up the way synthetic.py writes journals in
+entries (abbreviated, lower case, with typos), leaving out those that are
+exact hits. matchmany uses rapidfuzz.process.cdist if rapidfuzz and numpy
+are installed, one rapidfuzz extractOne per journal with rapidfuzz alone,
+and match() otherwise; the results must be the same either way.
+'''
+
+import sys
+import os
+import time
+import random
+import argparse
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'src'))
+from btcleaner.matcher import JournalMatcher, batchbackend  #pylint: disable=E0401,C0413
+import synthetic  #pylint: disable=E0401,C0413
+
+
+def main():
+    '''Run the benchmark'''
+    parser = argparse.ArgumentParser(description=__doc__,
+                formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--journals', type=int, default=20000,
+                        help='Number of journals in the abbreviation list.')
+    parser.add_argument('--queries', type=int, default=2000,
+                        help='Number of distinct journal strings to score.')
+    parser.add_argument('--seed', type=int, default=1,
+                        help='Seed for the synthetic data.')
+    opts = parser.parse_args()
+
+    rng = random.Random(opts.seed)
+    journals = synthetic.journals(opts.journals, rng)
+    names = list(journals)
+    queries = {}
+    while len(queries) < opts.queries:
+        _n = rng.choice(names)
+        _q = synthetic.variant(_n, journals[_n], rng)
+        if _q not in journals and _q not in journals.values():
+            queries[_q] = None
+    queries = list(queries)
+
+    _t = time.perf_counter()
+    matcher = JournalMatcher(journals)
+    t_build = time.perf_counter() - _t
+    _t = time.perf_counter()
+    single = {_q: matcher.match(_q) for _q in queries}
+    t_single = time.perf_counter() - _t
+    _t = time.perf_counter()
+    batch = matcher.matchmany(queries)
+    t_batch = time.perf_counter() - _t
+
+    print('%d journals (%d candidate strings), %d queries' % (
+        len(journals), len(matcher), len(queries)))
+    print('%-24s %8.2f s' % ('build matcher', t_build))
+    print('%-24s %8.2f s %10.0f /s' % ('match', t_single, len(queries)/t_single))
+    print('%-24s %8.2f s %10.0f /s' % ('matchmany (%s)' % batchbackend(),
+                                       t_batch, len(queries)/t_batch))
+    if batch != single:
+        sys.exit('matchmany disagrees with match on %d queries' % sum(
+            1 for _q in queries if batch[_q] != single[_q]))
+    print('Results are identical.')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+'''Compare the memory and lookup speed of a dict of journals and a JournalTable.
+
+Pass one or more abbreviation lists (files or URLs, e.g. every
+journal_abbreviations_*.csv from abbrv.jabref.org) to measure the real
+corpus, or --synthetic N to make up N journals. The dict is what
+cache.parseabbreviations returns; the JournalTable is built from it, and
+the reported size of each is what it holds once built, measured with
+tracemalloc.
+'''
+
+import sys
+import os
+import io
+import time
+import random
+import pickle
+import argparse
+import tracemalloc
+import contextlib
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'src'))
+from btcleaner import cache  #pylint: disable=E0401,C0413
+from btcleaner.journaltable import JournalTable  #pylint: disable=E0401,C0413
+import synthetic  #pylint: disable=E0401,C0413
+
+
+def readlines(urls):
+    '''Return the lines of every abbreviation list'''
+    lines = []
+    for url in urls:
+        lines += list(cache.fetch(url).lines)
+    return lines
+
+def measure(func):
+    '''Return (result, kB held by the result, peak kB) of calling func'''
+    tracemalloc.start()
+    _r = func()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return _r, current/1024, peak/1024
+
+def timeit(func, n):
+    '''Return microseconds per call of func over n calls'''
+    _t = time.perf_counter()
+    for _ in range(n):
+        func()
+    return (time.perf_counter() - _t) / n * 1e6
+
+def main():
+    '''Run the benchmark'''
+    parser = argparse.ArgumentParser(description=__doc__,
+                formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('lists', nargs='*', help='Abbreviation lists (files or URLs).')
+    parser.add_argument('--synthetic', type=int, default=100000,
+                        help='Number of journals to make up if no lists are given.')
+    parser.add_argument('--lookups', type=int, default=10000,
+                        help='Number of random lookups to time.')
+    parser.add_argument('--seed', type=int, default=1,
+                        help='Seed for the synthetic data and the lookups.')
+    opts = parser.parse_args()
+
+    rng = random.Random(opts.seed)
+    if opts.lists:
+        lines = readlines(opts.lists)
+    else:
+        lines = synthetic.abbreviationlines(synthetic.journals(opts.synthetic, rng), rng)
+    with contextlib.redirect_stdout(io.StringIO()):
+        journals, dict_kb, dict_peak = measure(lambda: cache.parseabbreviations(lines))
+    del lines
+    table, table_kb, table_peak = measure(lambda: JournalTable(journals))
+    if list(table.items()) != list(journals.items()):
+        sys.exit('The JournalTable does not match the dict.')
+
+    names = rng.choices(list(journals), k=opts.lookups)
+    abbrevs = [journals[_n] for _n in names]
+    reverse = {}
+    for _n, _a in journals.items():
+        reverse.setdefault(_a, _n)
+    print('%d journals, %d distinct abbreviations' % (len(journals), len(reverse)))
+    print('%-28s %12s %12s' % ('', 'dict', 'JournalTable'))
+    print('%-28s %9.0f kB %9.0f kB' % ('held after building', dict_kb, table_kb))
+    print('%-28s %9.0f kB %9.0f kB' % ('peak while building', dict_peak, table_peak))
+    print('%-28s %9.0f kB %9.0f kB' % ('pickled', len(pickle.dumps(journals))/1024,
+                                       len(pickle.dumps(table))/1024))
+    print('%-28s %9.1f ms %9.1f ms' % ('pickle and unpickle',
+                                       timeit(lambda: pickle.loads(pickle.dumps(journals)), 3)/1e3,
+                                       timeit(lambda: pickle.loads(pickle.dumps(table)), 3)/1e3))
+    print('%-28s %9.2f us %9.2f us' % ('lookup', timeit(lambda: [journals[_n] for _n in names], 1)
+                                       / len(names),
+                                       timeit(lambda: [table[_n] for _n in names], 1)
+                                       / len(names)))
+    print('%-28s %9.2f us %9.2f us' % ('reverse lookup (dict: 2nd dict)',
+                                       timeit(lambda: [reverse[_a] for _a in abbrevs], 1)
+                                       / len(abbrevs),
+                                       timeit(lambda: [table.getname(_a) for _a in abbrevs], 1)
+                                       / len(abbrevs)))
+    print('%-28s %9.3f s  %9.3f s' % ('iterate items()',
+                                      timeit(lambda: list(journals.items()), 1)/1e6,
+                                      timeit(lambda: list(table.items()), 1)/1e6))
+
+if __name__ == '__main__':
+    main()
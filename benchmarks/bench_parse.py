@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+'''Measure the throughput (lines/sec) of the abbreviation list parser.
+
+Pass JabRef abbreviation lists to parse real data, or --synthetic N to
+generate N lines in the JabRef csv format (see synthetic.py; some are
+quoted and have the extra shortest-abbreviation column).
+'''
+
+import sys
+import os
+import time
+import random
+import argparse
+import contextlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from btcleaner import cache  #pylint: disable=E0401,C0413
+import synthetic  #pylint: disable=E0401,C0413
+
+
+def legacyparse(jlines):
+    '''The parser that shipped before the streaming one, for comparison'''
+    journals = {}
+    for _l in jlines:
+        _t, _a = None, None
+        for _delim in (';', '='):
+            try:
+                _t,_a = _l.split(_delim)
+            except ValueError:
+                continue
+        if _t is None or _a is None:
+            continue
+        journals[_t.strip()] = _a.strip()
+        if len(_t.split('(')) > 1:
+            journals[_t.split('(')[0].strip()] = _a.split('(')[0].strip()
+        print("Adding custom journal %s => %s" % (_t, _a))
+    return journals
+
+def main():
+    '''Run the benchmark'''
+    parser = argparse.ArgumentParser(description=__doc__,
+                formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('lists', nargs='*', help='JabRef abbreviation csv files.')
+    parser.add_argument('--synthetic', type=int, default=60000,
+                        help='Number of lines to make up if no lists are given.')
+    parser.add_argument('--seed', type=int, default=1,
+                        help='Seed for the synthetic data.')
+    opts = parser.parse_args()
+
+    lines = []
+    for _fn in opts.lists:
+        with open(_fn, encoding='utf8') as fh:
+            lines += fh.read().split('\n')
+    if not lines:
+        rng = random.Random(opts.seed)
+        lines = synthetic.abbreviationlines(synthetic.journals(opts.synthetic, rng), rng)
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        _t = time.perf_counter()
+        legacy = legacyparse(lines)
+        t_legacy = time.perf_counter() - _t
+        _t = time.perf_counter()
+        journals = cache.parseabbreviations(iter(lines))
+        t_stream = time.perf_counter() - _t
+    print('%d lines' % len(lines))
+    print('%-12s %10.0f lines/s %8d journals' % ('legacy', len(lines)/t_legacy, len(legacy)))
+    print('%-12s %10.0f lines/s %8d journals' % ('streaming', len(lines)/t_stream, len(journals)))
+
+if __name__ == '__main__':
+    main()
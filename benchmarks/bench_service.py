@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+'''Compare the latency of cleaning a small bib file cold and through a warm server.
+
+A cold clean runs the bibtexcleaner script once per file, so it pays for
+interpreter startup, imports, opening the cache and building the matcher
+every time. A warm clean POSTs the same file to bibtexcleaner --serve.
+Both use a throwaway cache directory, so the real cache is left alone.
+The abbreviations and the bib file are made up (see synthetic.py).
+'''
+
+import sys
+import os
+import time
+import json
+import random
+import tempfile
+import argparse
+import subprocess
+import statistics
+import urllib.request
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC)
+from btcleaner import cleanremote  #pylint: disable=E0401,C0413
+import synthetic  #pylint: disable=E0401,C0413
+
+
+def waitfor(port, proc, timeout=120):
+    '''Wait until the server on port answers /ping'''
+    stop = time.time() + timeout
+    while time.time() < stop:
+        if proc.poll() is not None:
+            sys.exit('The server exited with status %s' % proc.returncode)
+        try:
+            with urllib.request.urlopen('http://127.0.0.1:%s/ping' % port) as fh:
+                return json.loads(fh.read().decode('utf8'))
+        except OSError:
+            time.sleep(0.2)
+    sys.exit('The server did not start in %s seconds' % timeout)
+
+def summary(name, times):
+    '''Print the median and spread of times in ms'''
+    print('%-8s median %8.1f ms   min %8.1f ms   max %8.1f ms' % (name,
+          statistics.median(times)*1000, min(times)*1000, max(times)*1000))
+
+def main():
+    '''Run the benchmark'''
+    parser = argparse.ArgumentParser(description=__doc__,
+                formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--journals', type=int, default=20000,
+                        help='Number of journals in the abbreviation list.')
+    parser.add_argument('--entries', type=int, default=25,
+                        help='Number of entries in the bib file.')
+    parser.add_argument('--runs', type=int, default=5,
+                        help='Number of cleans to time each way.')
+    parser.add_argument('--port', type=int, default=8766,
+                        help='Port for the warm server.')
+    parser.add_argument('--seed', type=int, default=1,
+                        help='Seed for the synthetic data.')
+    opts = parser.parse_args()
+
+    rng = random.Random(opts.seed)
+    journals = synthetic.journals(opts.journals, rng)
+    jlines = synthetic.abbreviationlines(journals, rng)
+    bibtex = synthetic.bibtex(synthetic.entries(opts.entries, journals, rng))
+    script = os.path.join(SRC, 'bibtexcleaner')
+    with tempfile.TemporaryDirectory() as tmpdir:
+        # Keep the cache of the benchmark out of the real one
+        env = dict(os.environ, HOME=tmpdir, APPDATA=tmpdir,
+                   PYTHONPATH=os.pathsep.join([SRC, os.environ.get('PYTHONPATH', '')]))
+        jfn = os.path.join(tmpdir, 'journals.csv')
+        bfn = os.path.join(tmpdir, 'refs.bib')
+        with open(jfn, 'w', encoding='utf8') as fh:
+            fh.write('\n'.join(jlines))
+        cmd = [sys.executable, script, '-d', jfn, '--batch', '--full']
+        # Fetch the list into the cache once so neither side pays for it
+        with open(bfn, 'w', encoding='utf8') as fh:
+            fh.write(bibtex)
+        subprocess.run(cmd + [bfn], env=env, stdout=subprocess.DEVNULL, check=True)
+
+        cold = []
+        for _ in range(opts.runs):
+            with open(bfn, 'w', encoding='utf8') as fh:
+                fh.write(bibtex)
+            _t = time.perf_counter()
+            subprocess.run(cmd + [bfn], env=env, stdout=subprocess.DEVNULL, check=True)
+            cold.append(time.perf_counter() - _t)
+
+        server = subprocess.Popen([sys.executable, script, '-d', jfn, '--serve', str(opts.port)],
+                                  env=env, stdout=subprocess.DEVNULL,
+                                  stderr=subprocess.DEVNULL)
+        try:
+            _t = time.perf_counter()
+            waitfor(opts.port, server)
+            started = time.perf_counter() - _t
+            warm = []
+            for _ in range(opts.runs):
+                _t = time.perf_counter()
+                cleanremote(bibtex, port=opts.port)
+                warm.append(time.perf_counter() - _t)
+        finally:
+            server.terminate()
+            server.wait()
+
+    print('%d journals, %d entries, %d runs' % (opts.journals, opts.entries, opts.runs))
+    summary('cold', cold)
+    summary('warm', warm)
+    print('%-8s %15.1f ms to start the server' % ('', started*1000))
+
+if __name__ == '__main__':
+    main()
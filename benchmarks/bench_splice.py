@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+'''Time saving a bib file in which only a few entries changed.
+
+A made-up bib file (see synthetic.py) is parsed with btcleaner.BibFile,
+a fraction of its entries is changed and it is saved twice: whole, as
+--rewrite does with BibTexWriter, and by BibFile.write, which copies the
+unchanged entries from the original file. The splice must leave every
+unchanged byte of the file as it was and parse back to the same entries.
+'''
+
+import sys
+import os
+import time
+import random
+import argparse
+import tempfile
+import contextlib
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'src'))
+from bibtexparser.bwriter import BibTexWriter  #pylint: disable=C0413
+from btcleaner import BibFile  #pylint: disable=E0401,C0413
+import synthetic  #pylint: disable=E0401,C0413
+
+
+def timeit(func):
+    '''Return (seconds, result) of calling func'''
+    _t = time.perf_counter()
+    _r = func()
+    return time.perf_counter() - _t, _r
+
+def main():
+    '''Run the benchmark'''
+    parser = argparse.ArgumentParser(description=__doc__,
+                formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--entries', type=int, default=2000,
+                        help='Number of entries in the bib file.')
+    parser.add_argument('--changed', type=float, default=0.01,
+                        help='Fraction of entries to change.')
+    parser.add_argument('--seed', type=int, default=1,
+                        help='Seed for the synthetic data.')
+    opts = parser.parse_args()
+
+    rng = random.Random(opts.seed)
+    records = synthetic.entries(opts.entries, synthetic.journals(1000, rng), rng)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        bibfile = os.path.join(tmpdir, 'refs.bib')
+        with open(bibfile, 'w') as fh:
+            fh.write(synthetic.bibtex(records))
+        t_parse, source = timeit(lambda: BibFile(bibfile))
+        changed = rng.sample(range(len(source.entries)), int(len(source.entries)*opts.changed))
+        for i in changed:
+            source.entries[i]['title'] = source.entries[i]['title'].upper()
+
+        def rewrite():
+            with open(os.path.join(tmpdir, 'whole.bib'), 'w') as fh:
+                fh.write(BibTexWriter().write(source.database()))
+        t_rewrite, _ = timeit(rewrite)
+        with contextlib.redirect_stdout(None):
+            t_splice, _ = timeit(lambda: source.write(path=os.path.join(tmpdir, 'splice.bib')))
+
+        after = BibFile(os.path.join(tmpdir, 'splice.bib'))
+        if after.entries != source.entries:
+            sys.exit('The spliced file does not parse back to the same entries')
+        print('%d entries, %d changed' % (len(source.entries), len(changed)))
+        print('%-10s %10.1f ms' % ('parse', t_parse*1e3))
+        print('%-10s %10.1f ms' % ('rewrite', t_rewrite*1e3))
+        print('%-10s %10.1f ms %7.1fx' % ('splice', t_splice*1e3, t_rewrite/t_splice))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+'''Check how long it takes to import btcleaner for each kind of run against a budget.
+
+Every scenario is run with python -X importtime a few times; the median
+of the time spent importing modules that a bare interpreter does not
+import is compared with its budget in ms. The slowest modules are listed
+so a regression can be traced to the import that caused it. Exits with
+status 1 if any scenario is over budget, so it can run in CI.
+'''
+
+import sys
+import os
+import argparse
+import subprocess
+import statistics
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+# Name, python arguments and budget in ms
+SCENARIOS = (('import', ['-c', 'import btcleaner'], 15),
+             ('refresh', ['-c', 'import btcleaner; btcleaner.cache'], 25),
+             ('clean', ['-c', 'import btcleaner; btcleaner.Cleaner; btcleaner.stream'], 150),
+             ('script --help', [os.path.join(SRC, 'bibtexcleaner'), '--help'], 15))
+
+
+def importtimes(args):
+    '''Return {module: (self us, cumulative us, depth)} from python -X importtime args'''
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([SRC, os.environ.get('PYTHONPATH', '')]))
+    _p = subprocess.run([sys.executable, '-X', 'importtime'] + args, env=env,
+                        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                        universal_newlines=True, check=True)
+    times = {}
+    for _l in _p.stderr.splitlines():
+        if not _l.startswith('import time:') or 'self [us]' in _l:
+            continue
+        _self, _cum, _name = _l[len('import time:'):].split('|')
+        depth = (len(_name) - len(_name.lstrip())) // 2
+        times[_name.strip()] = (int(_self), int(_cum), depth)
+    return times
+
+def measure(args, baseline, runs):
+    '''Return the median import time in ms of args and its slowest modules of the last run'''
+    totals = []
+    for _ in range(runs):
+        times = importtimes(args)
+        totals.append(sum(_c for _n, (_s, _c, _d) in times.items()
+                          if _d == 0 and _n not in baseline) / 1000)
+    slowest = sorted(((_s/1000, _n) for _n, (_s, _c, _d) in times.items()
+                      if _n not in baseline), reverse=True)
+    return statistics.median(totals), slowest
+
+def main():
+    '''Run the benchmark'''
+    parser = argparse.ArgumentParser(description=__doc__,
+                formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5,
+                        help='Number of times to run each scenario.')
+    parser.add_argument('--top', type=int, default=5,
+                        help='Number of slowest modules to list for each scenario.')
+    parser.add_argument('--budget', action='append', default=[],
+                        help="Override a budget, e.g. --budget 'clean=200'.")
+    opts = parser.parse_args()
+
+    budgets = {_n: _b for _n, _a, _b in SCENARIOS}
+    for _o in opts.budget:
+        _n, _b = _o.rsplit('=', 1)
+        budgets[_n] = float(_b)
+    baseline = set(importtimes(['-c', 'pass']))
+    over = []
+    for name, args, _b in SCENARIOS:
+        total, slowest = measure(args, baseline, opts.runs)
+        status = 'ok'
+        if total > budgets[name]:
+            status = 'OVER BUDGET'
+            over.append(name)
+        print('%-14s %8.1f ms  (budget %6.1f ms)  %s' % (name, total, budgets[name], status))
+        for _t, _n in slowest[:opts.top]:
+            print('%16s %8.1f ms  %s' % ('', _t, _n))
+    if over:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
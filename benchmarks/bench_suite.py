@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+'''Time the main stages of the cleaner and BibtoHTML on synthetic data and catch regressions.
+
+For every --sizes N a bibliography of N entries is made up (see
+synthetic.py) and each benchmark is timed --repeat times, keeping the
+fastest run, then run once more under tracemalloc for its peak memory.
+Results are appended to --history with the commit they were measured on.
+Each result is compared with the last run in the history that used the
+same parameters; if throughput dropped or peak memory grew by more than
+the thresholds, the regressions are listed and the exit status is 1.
+'''
+
+import sys
+import os
+import io
+import json
+import time
+import random
+import argparse
+import datetime
+import tempfile
+import tracemalloc
+import subprocess
+import contextlib
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'src'))
+sys.path.insert(0, os.path.join(HERE, '..'))
+from bibtexparser.bibdatabase import BibDatabase  #pylint: disable=E0401,C0413
+from btcleaner import cache, dedupe, textnorm, Decisions  #pylint: disable=E0401,C0413
+from btcleaner.recordhandler import RecordHandler  #pylint: disable=E0401,C0413
+import BibtoHTML  #pylint: disable=E0401,C0413
+import synthetic  #pylint: disable=E0401,C0413
+
+
+class Data():
+    '''The synthetic journals and entries every benchmark of one size works on'''
+
+    def __init__(self, opts, size, tmpdir):
+        rng = random.Random(opts.seed)
+        self.journals = synthetic.journals(opts.journals, rng)
+        self.entries = synthetic.entries(size, self.journals, rng, opts.distribution,
+                                         opts.duprate, opts.missing)
+        self.listfile = os.path.join(tmpdir, 'journals.csv')
+        with open(self.listfile, 'w', encoding='utf8') as fh:
+            fh.write('\n'.join(synthetic.abbreviationlines(self.journals, rng)))
+        self.tmpdir = tmpdir
+
+    def copies(self):
+        '''Return fresh copies of the entries, since cleaning changes them'''
+        return [dict(_e) for _e in self.entries]
+
+
+# Each benchmark takes a Data and returns (number of items, function to time).
+# Everything done before returning is setup and is not measured; caches
+# that outlive a run are cleared so that every run starts cold.
+
+def bench_handle_record(data):
+    '''RecordHandler.handle_record on every entry, matcher build included'''
+    records = data.copies()
+    handler = RecordHandler(data.journals, None, Decisions(batch=True))
+    textnorm.clear()
+    return len(records), lambda: [handler.handle_record(_r) for _r in records]
+
+def bench_dodupecheck(data):
+    '''dedupe.dodupecheck on the whole bibliography'''
+    bib_database = BibDatabase()
+    bib_database.entries = data.copies()
+    return len(bib_database.entries), \
+        lambda: dedupe.dodupecheck(bib_database, Decisions(batch=True))
+
+def bench_getcache_cold(data):
+    '''cache.getcache reading, parsing and storing the abbreviation list'''
+    __freshcache(data)
+    return len(data.journals), lambda: cache.getcache([data.listfile]).close()
+
+def bench_getcache_warm(data):
+    '''cache.getcache from the cache and reading every journal from it'''
+    __freshcache(data)
+    cache.getcache([data.listfile]).close()
+    def run():
+        journals = cache.getcache([data.listfile])
+        dict(journals.items())
+        journals.close()
+    return len(data.journals), run
+
+def bench_putcustom(data):
+    '''cache.putcustom of every journal'''
+    __freshcache(data)
+    return len(data.journals), lambda: cache.putcustom(data.journals)
+
+def bench_html_handle_record(data):
+    '''BibtoHTML.RecordHandler.handle_record on every entry'''
+    records = data.copies()
+    handler = BibtoHTML.RecordHandler(BibtoHTML.parser.parse_args(['-b', 'Doe', 'x.bib']))
+    textnorm.clear()
+    return len(records), lambda: [handler.handle_record(_r) for _r in records]
+
+def bench_html_output(data):
+    '''BibtoHTML.RecordHandler.output of every formatted entry'''
+    handler = BibtoHTML.RecordHandler(BibtoHTML.parser.parse_args(['-b', 'Doe', 'x.bib']))
+    for _r in data.copies():
+        handler.handle_record(_r)
+    return len(data.entries), handler.output
+
+def __freshcache(data):
+    '''Point the cache at an empty file in the temporary directory'''
+    cache.CACHEDIR = data.tmpdir
+    cache.JCACHE = os.path.join(data.tmpdir, 'bench_%d.db' % time.perf_counter_ns())
+
+BENCHMARKS = (('handle_record', bench_handle_record),
+              ('dodupecheck', bench_dodupecheck),
+              ('getcache cold', bench_getcache_cold),
+              ('getcache warm', bench_getcache_warm),
+              ('putcustom', bench_putcustom),
+              ('BibtoHTML handle_record', bench_html_handle_record),
+              ('BibtoHTML outputHTML', bench_html_output))
+
+
+def measure(bench, data, repeat, memory):
+    '''Return {'items', 'seconds', 'throughput', 'peak_kb'} of a benchmark'''
+    best = None
+    for _ in range(repeat):
+        count, func = bench(data)
+        _t = time.perf_counter()
+        func()
+        _t = time.perf_counter() - _t
+        best = _t if best is None else min(best, _t)
+    result = {'items':count, 'seconds':best, 'throughput':count/best if best else 0}
+    if memory:
+        count, func = bench(data)
+        tracemalloc.start()
+        func()
+        result['peak_kb'] = tracemalloc.get_traced_memory()[1] / 1024
+        tracemalloc.stop()
+    return result
+
+def gitcommit():
+    '''Return the short hash of HEAD, marked + if the tree has changes, or ""'''
+    try:
+        _h = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE, check=True,
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                            universal_newlines=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                               cwd=HERE, check=True, stdout=subprocess.PIPE,
+                               universal_newlines=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+    return _h + ('+' if dirty else '')
+
+def regressions(results, previous, opts):
+    '''Return a description of every result that is worse than in previous'''
+    worse = []
+    for _k, _r in results.items():
+        if _k not in previous:
+            continue
+        _p = previous[_k]
+        if _r['throughput'] < _p['throughput'] * (1 - opts.threshold):
+            worse.append('%s: %.0f/s, was %.0f/s' % (_k, _r['throughput'], _p['throughput']))
+        # Ignore growth of a few kB, which is noise
+        if 'peak_kb' in _r and 'peak_kb' in _p \
+           and _r['peak_kb'] > _p['peak_kb'] * (1 + opts.memthreshold) + 64:
+            worse.append('%s: peak %.0f kB, was %.0f kB' % (_k, _r['peak_kb'], _p['peak_kb']))
+    return worse
+
+def main():
+    '''Run the benchmarks'''
+    parser = argparse.ArgumentParser(description=__doc__,
+                formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000],
+                        help='Numbers of entries to benchmark (e.g. 1000 10000 200000).')
+    parser.add_argument('--journals', type=int, default=5000,
+                        help='Number of journals in the abbreviation list.')
+    parser.add_argument('--distribution', choices=('zipf', 'uniform'), default='zipf',
+                        help='How often each journal is cited.')
+    parser.add_argument('--duprate', type=float, default=0.05,
+                        help='Fraction of entries that duplicate another.')
+    parser.add_argument('--missing', type=float, default=0.05,
+                        help='Fraction of entries missing one or more fields.')
+    parser.add_argument('--seed', type=int, default=1,
+                        help='Seed for the synthetic data.')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Time each benchmark this many times and keep the fastest.')
+    parser.add_argument('--only', nargs='+', default=[],
+                        help='Run only benchmarks whose name contains one of these.')
+    parser.add_argument('--no-memory', action='store_true', default=False,
+                        help='Skip the tracemalloc run.')
+    parser.add_argument('--history', default=os.path.join(HERE, 'history.json'),
+                        help='JSON file of earlier results to compare with and append to.')
+    parser.add_argument('--no-save', action='store_true', default=False,
+                        help='Compare with the history but do not add this run to it.')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='Fail if throughput drops by more than this fraction.')
+    parser.add_argument('--memthreshold', type=float, default=0.2,
+                        help='Fail if peak memory grows by more than this fraction.')
+    opts = parser.parse_args()
+
+    params = {_k: getattr(opts, _k) for _k in ('journals', 'distribution', 'duprate',
+                                               'missing', 'seed')}
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for size in opts.sizes:
+            data = Data(opts, size, tmpdir)
+            for name, bench in BENCHMARKS:
+                if opts.only and not any(_o in name for _o in opts.only):
+                    continue
+                # The code under test prints a lot; keep it out of the table
+                with contextlib.redirect_stdout(io.StringIO()):
+                    result = measure(bench, data, opts.repeat, not opts.no_memory)
+                results['%s @ %d' % (name, size)] = result
+                print('%-32s %8d %10.3f s %12.0f /s %12s' % (name, result['items'], result['seconds'],
+                      result['throughput'],
+                      '%.0f kB' % result['peak_kb'] if 'peak_kb' in result else ''))
+
+    history = []
+    if os.path.exists(opts.history):
+        with open(opts.history, encoding='utf8') as fh:
+            history = json.load(fh)
+    previous = [_h for _h in history if _h['params'] == params]
+    worse = regressions(results, previous[-1]['results'], opts) if previous else []
+    if previous:
+        print('\nCompared with %s (%s):' % (previous[-1]['commit'] or 'unknown commit',
+                                           previous[-1]['date']))
+        print('\n'.join(worse) if worse else 'No regressions.')
+    if not opts.no_save:
+        history.append({'commit':gitcommit(),
+                        'date':datetime.datetime.now().isoformat(timespec='seconds'),
+                        'python':sys.version.split()[0],
+                        'params':params,
+                        'results':results})
+        with open(opts.history, 'w', encoding='utf8') as fh:
+            json.dump(history, fh, indent=1)
+    if worse:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
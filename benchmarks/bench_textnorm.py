@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+'''Time the text transforms of one record with and without btcleaner.textnorm.
+
+The fields are those of synthetic entries (see synthetic.py). "cleaner" is
+what RecordHandler does to a record: titlecase the title and LaTeX-encode
+the journal. "BibtoHTML" is what BibtoHTML.RecordHandler does: decode the
+LaTeX of every author, the title, journal, volume, pages and year and
+titlecase the title. Each is timed calling the transforms directly and
+through textnorm's caches and fast paths, which start empty, and the
+results must be the same.
+'''
+
+import sys
+import os
+import time
+import random
+import argparse
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'src'))
+from btcleaner import textnorm  #pylint: disable=E0401,C0413
+import synthetic  #pylint: disable=E0401,C0413
+
+
+def cleaner(entries, titlecase, tolatex):
+    '''Transform the fields RecordHandler transforms'''
+    return [(titlecase(_e['title']), tolatex(_e.get('journal', ''))) for _e in entries]
+
+def bibtohtml(entries, titlecase, cleanlatex):
+    '''Transform the fields BibtoHTML.RecordHandler transforms'''
+    out = []
+    for _e in entries:
+        out.append(([cleanlatex(_a) for _a in _e['author'].split('and')],
+                    titlecase(cleanlatex(_e['title'])),
+                    cleanlatex(_e.get('journal', '')), cleanlatex(_e.get('volume', '')),
+                    cleanlatex(_e.get('pages', '')), cleanlatex(_e['year'])))
+    return out
+
+def timeit(func):
+    '''Return (seconds, result) of calling func'''
+    _t = time.perf_counter()
+    _r = func()
+    return time.perf_counter() - _t, _r
+
+def main():
+    '''Run the benchmark'''
+    parser = argparse.ArgumentParser(description=__doc__,
+                formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--entries', type=int, default=10000,
+                        help='Number of entries to transform.')
+    parser.add_argument('--journals', type=int, default=5000,
+                        help='Number of journals in the abbreviation list.')
+    parser.add_argument('--duprate', type=float, default=0.05,
+                        help='Fraction of entries that duplicate another.')
+    parser.add_argument('--seed', type=int, default=1,
+                        help='Seed for the synthetic data.')
+    opts = parser.parse_args()
+
+    rng = random.Random(opts.seed)
+    entries = synthetic.entries(opts.entries, synthetic.journals(opts.journals, rng), rng,
+                                duprate=opts.duprate, missing=0)
+    runs = (('cleaner', cleaner, (textnorm.TITLECASE.func, textnorm.TOLATEX.func),
+             (textnorm.titlecase, textnorm.tolatex)),
+            ('BibtoHTML', bibtohtml, (textnorm.TITLECASE.func, textnorm.CLEANLATEX.func),
+             (textnorm.titlecase, textnorm.cleanlatex)))
+    print('%d entries' % len(entries))
+    print('%-12s %14s %14s %8s' % ('', 'direct', 'textnorm', 'speedup'))
+    for name, func, direct, memoized in runs:
+        t_direct, expected = timeit(lambda: func(entries, *direct))
+        t_memo, result = timeit(lambda: func(entries, *memoized))
+        if result != expected:
+            sys.exit('textnorm changes the result of %s' % name)
+        print('%-12s %11.1f us %11.1f us %7.1fx' % (name, t_direct/len(entries)*1e6,
+                                                     t_memo/len(entries)*1e6, t_direct/t_memo))
+    for _k, _v in textnorm.counters().items():
+        print('%-24s %d' % (_k, _v))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+'''Make up abbreviation lists and bibliographies for the benchmarks.
+
+Everything is drawn from a random.Random seeded by the caller, so the same
+arguments always give the same data and runs on different commits can be
+compared.
+'''
+
+import itertools
+
+WORDS = ('Journal', 'of', 'Chemical', 'Physical', 'Letters', 'Review', 'Applied',
+         'Materials', 'Advanced', 'Nano', 'Science', 'Society', 'Research',
+         'International', 'European', 'American', 'Biology', 'Engineering',
+         'Molecular', 'Organic', 'Surface', 'Electronic', 'Systems', 'Annals')
+SURNAMES = ('Smith', 'Doe', 'Jansen', 'de Vries', 'M{\\"u}ller', 'Garc{\\\'\\i}a',
+            'Chen', 'Wang', 'Kumar', 'Nguyen', 'Rossi', 'Kowalski', 'Haley')
+GIVEN = ('Jane', 'John', 'R. C.', 'Maria', 'Wei', 'Anna', 'P.', 'Lars', 'Y.')
+TITLEWORDS = ('a', 'study', 'of', 'the', 'self-assembled', 'monolayers', 'on',
+              'gold', 'and', 'tunneling', 'transport', 'in', 'molecular',
+              'junctions', 'with', 'quantum', 'interference', 'effects', '{DNA}',
+              'graphene', 'at', 'room', 'temperature', '$\\pi$-stacking')
+MONTHS = ('jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct',
+          'nov', 'dec', '1', '6', 'March', 'October')
+# Fields dropped from entries that are missing something, in this order of likelihood
+OPTIONAL = ('doi', 'month', 'pages', 'volume', 'journal')
+
+
+def journals(n, rng):
+    '''Return n made-up journals as an ordered dict of full name -> abbreviation'''
+    _j = {}
+    while len(_j) < n:
+        _t = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(2, 7)))
+        _t = '%s %s' % (_t, len(_j))
+        _j[_t] = ' '.join(_w if _w.isdigit() else _w[:4]+'.' for _w in _t.split()
+                          if _w not in ('of', 'and'))
+    return _j
+
+def abbreviationlines(_journals, rng):
+    '''Return the lines of a JabRef csv list of _journals, some of them quoted'''
+    lines = []
+    for _t, _a in _journals.items():
+        if rng.random() < 0.3:
+            lines.append('"%s";"%s";"%s"' % (_t, _a, _a.replace('.', '')))
+        else:
+            lines.append('%s;%s' % (_t, _a))
+    return lines
+
+def journalweights(n, distribution):
+    '''Return cumulative weights for picking among n journals'''
+    if distribution == 'uniform':
+        weights = [1.0]*n
+    else:
+        # Zipf-like: a few journals are cited a lot, most are cited rarely
+        weights = [1.0/(_r+1)**1.1 for _r in range(n)]
+    return list(itertools.accumulate(weights))
+
+def variant(name, abbrev, rng):
+    '''Return the way a journal is written in an entry'''
+    _r = rng.random()
+    if _r < 0.55:
+        return name
+    if _r < 0.8:
+        return abbrev
+    if _r < 0.9:
+        return name.lower()
+    # A typo
+    _i = rng.randrange(len(name))
+    return name[:_i] + name[_i+1:]
+
+def entries(n, _journals, rng, distribution='zipf', duprate=0.05, missing=0.05):
+    '''Return n journal articles as bibtexparser records.
+
+    Journals are picked from _journals with the given distribution ('zipf'
+    or 'uniform') and written in full, abbreviated, in lower case or with a
+    typo. A fraction duprate of the entries are copies of earlier ones under
+    a new ID and a fraction missing lack one or more fields.
+    '''
+    names = list(_journals)
+    cum = journalweights(len(names), distribution)
+    records = []
+    for i in range(n):
+        if records and rng.random() < duprate:
+            record = dict(rng.choice(records))
+            record['ID'] = 'dupe%d' % i
+            records.append(record)
+            continue
+        _j = rng.choices(names, cum_weights=cum)[0]
+        page = rng.randint(1, 20000)
+        authors = ['%s, %s' % (rng.choice(SURNAMES), rng.choice(GIVEN))
+                   for _ in range(rng.randint(1, 8))]
+        record = {'ENTRYTYPE': 'article',
+                  'ID': 'key%d' % i,
+                  'author': ' and '.join(authors) if rng.random() < 0.9 else authors[0],
+                  'title': ' '.join(rng.choice(TITLEWORDS) for _ in range(rng.randint(4, 14))),
+                  'journal': variant(_j, _journals[_j], rng),
+                  'volume': str(rng.randint(1, 150)),
+                  'pages': '%d--%d' % (page, page+rng.randint(1, 20)),
+                  'year': str(rng.randint(1980, 2021)),
+                  'month': rng.choice(MONTHS),
+                  'doi': '10.%d/synth.%d' % (rng.randint(1000, 9999), i)}
+        if rng.random() < missing:
+            for _f in OPTIONAL[:rng.randint(1, len(OPTIONAL))]:
+                del record[_f]
+        records.append(record)
+    return records
+
+def bibtex(records):
+    '''Return records as the text of a bib file'''
+    out = []
+    for record in records:
+        fields = ',\n'.join(' %s = {%s}' % (_k, _v) for _k, _v in record.items()
+                            if _k not in ('ENTRYTYPE', 'ID'))
+        out.append('@%s{%s,\n%s\n}\n' % (record['ENTRYTYPE'], record['ID'], fields))
+    return '\n'.join(out)
@@ -27,10 +27,20 @@ setuptools.setup(name='bibtexcleaner',
           'bibtexparser>=1.2.0',
           'colorama>=0.4.4',
           'python-Levenshtein>=0.12.2',
-          'titlecase>=2.0.0'
+          'titlecase>=2.0.0',
+          # Downloads abbreviation lists, see btcleaner.fetcher
+          'requests>=2.20.0',
+          # Decodes LaTeX for BibtoHTML.py, see btcleaner.textnorm
+          'latexcodec>=2.0.0'
       ],
+      extras_require={
+          # Score all unknown journals of a run at once, see JournalMatcher.matchmany
+          'fast': ['rapidfuzz>=2.0.0', 'numpy']
+      },
       include_package_data=True,
       scripts = [
-        os.path.join("src", 'bibtexcleaner')
+        os.path.join("src", 'bibtexcleaner'),
+        # Uses btcleaner, so it is installed along with it
+        'BibtoHTML.py'
         ]
       )
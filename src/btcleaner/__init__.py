@@ -4,30 +4,91 @@ __version__ = "0.1"
 __author__ = 'Ryan C. Chiechi'
 __credits__ = 'University of Groningen'
 
-__all__ = ['refresh', 'load', 'save', 'dedupe_database']
+__all__ = ['refresh', 'load', 'save', 'loadmatches', 'savematches',
+           'loadmanifest', 'savemanifest', 'dedupe_database',
+           'cleanstream', 'Decisions', 'Cleaner', 'serve', 'cleanremote', 'PORT',
+           'PROFILER', 'JournalTable', 'Workspace', 'isworkspace', 'findbibfiles',
+           'BibFile']
 
-from . import cache, dedupe, recordhandler
+import importlib
+
+# Submodules are imported on first use so that importing the package (or
+# running a --refresh) does not pay for bibtexparser, titlecase, Levenshtein
+# and requests. Colors are left to the caller: the scripts call
+# colorama.init(autoreset=True) once at startup.
+__lazy = {'Decisions': 'decisions',
+          'Cleaner': 'cleaner',
+          'serve': 'server',
+          'cleanremote': 'server',
+          'PORT': 'server',
+          'PROFILER': 'profiler',
+          'JournalTable': 'journaltable',
+          'Workspace': 'workspace',
+          'isworkspace': 'workspace',
+          'findbibfiles': 'workspace',
+          'BibFile': 'splice'}
+__submodules = ('cache', 'canonical', 'cleaner', 'decisions', 'dedupe', 'fetcher',
+                'journaltable', 'matcher', 'profiler', 'recordhandler', 'server', 'splice',
+                'stream', 'textnorm', 'workspace')
+
+def __getattr__(name):
+    '''Import submodules and the names they provide when they are first used'''
+    if name in __lazy:
+        return getattr(importlib.import_module('.'+__lazy[name], __name__), name)
+    if name in __submodules:
+        return importlib.import_module('.'+name, __name__)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+def __dir__():
+    '''List the lazily imported names along with the others'''
+    return sorted(set(globals()) | set(__lazy) | set(__submodules))
 
 def refresh():
     '''Call refershcache function from cache'''
+    from . import cache  #pylint: disable=C0415
     cache.refreshcache()
 
-def load(database, _custom=None):
-    '''Call getcache function from cache and refresh if there is an error.'''
-    _journals = cache.getcache(database, _custom)
-    if not _journals:
-        refresh()
-        _journals = cache.getcache(database, _custom)
-    return _journals
+def load(database, _custom=None, _refresh=False):
+    '''Call getcache function from cache, which starts over if the cache is broken'''
+    from . import cache  #pylint: disable=C0415
+    return cache.getcache(database, _custom, _refresh)
+
+def save(custom):
+    '''Call putcustom from cache to save a dict of custom abbreviations'''
+    from . import cache  #pylint: disable=C0415
+    cache.putcustom(custom)
 
-def save(_journals):
-    '''Call putcache from cache'''
-    cache.putcache(_journals)
+def loadmatches(_journals):
+    '''Call getmatchcache from cache'''
+    from . import cache  #pylint: disable=C0415
+    return cache.getmatchcache(_journals)
 
-def dedupe_database(bib_database):
+def savematches(matches, _journals):
+    '''Call putmatchcache from cache'''
+    from . import cache  #pylint: disable=C0415
+    cache.putmatchcache(matches, _journals)
+
+def loadmanifest(bibfile, _journals):
+    '''Call getmanifest from cache'''
+    from . import cache  #pylint: disable=C0415
+    return cache.getmanifest(bibfile, _journals)
+
+def savemanifest(bibfile, hashes, _journals):
+    '''Call putmanifest from cache'''
+    from . import cache  #pylint: disable=C0415
+    cache.putmanifest(bibfile, hashes, _journals)
+
+def dedupe_database(bib_database, decisions=None):
     '''Call the dedupecheck funnction'''
-    return dedupe.dodupecheck(bib_database)
+    from . import dedupe  #pylint: disable=C0415
+    return dedupe.dodupecheck(bib_database, decisions)
+
+def cleanstream(bibfile, records, decisions=None):
+    '''Call cleanstream from stream and return the name of the cleaned file'''
+    from . import stream  #pylint: disable=C0415
+    return stream.cleanstream(bibfile, records, decisions)
 
-def getrecordhandler(journals):
+def getrecordhandler(journals, matches=None, decisions=None, manifest=None):
     '''Return a RecordHandler instance'''
-    return recordhandler.RecordHandler(journals)
+    from . import recordhandler  #pylint: disable=C0415
+    return recordhandler.RecordHandler(journals, matches, decisions, manifest)
@@ -2,87 +2,509 @@
 import sys
 import os
 import tempfile
-import pickle
+import hashlib
+import sqlite3
+import csv
+import urllib.parse
+from collections.abc import Mapping
 
 try:
-    import requests
-    from colorama import init,Fore,Style
+    from colorama import Fore,Style
 except ImportError as msg:
     print("Error importing package: %s" % str(msg))
     sys.exit(1)
 
-# Setup colors
-init(autoreset=True)
+from .canonical import canonical, buildindex
+from .profiler import PROFILER
+from . import fetcher
+from .fetcher import FetchError, Fetched
 
-# Setup cache dir
+# Setup cache dir; it is created by makecachedir() when the cache is opened
 if 'APPDATA' in os.environ:
     CACHEDIR = os.path.join(
         os.getenv('APPDATA'), 'BibTexCleaner')
 else:
     CACHEDIR = os.path.join(
         os.path.expanduser('~'), '.cache')
+JCACHE=os.path.join(CACHEDIR,'journal_abbreviations.db')
+# Whole-file pickles used by earlier versions, removed by refreshcache()
+LEGACY_JCACHE=os.path.join(CACHEDIR,'journal_abbreviations.cache')
+LEGACY_MCACHE=os.path.join(CACHEDIR,'journal_matches.cache')
+# Bump this when the layout of JCACHE or the way matches are scored changes
+JCACHE_VERSION = 3
+# Source name under which abbreviations entered by the user are kept
+CUSTOM = 'custom:'
 
-if not os.path.exists(CACHEDIR):
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS sources (url TEXT PRIMARY KEY,
+                                    etag TEXT,
+                                    modified TEXT,
+                                    sha1 TEXT);
+CREATE TABLE IF NOT EXISTS source_journals (seq INTEGER PRIMARY KEY,
+                                            url TEXT NOT NULL,
+                                            name TEXT NOT NULL,
+                                            abbrev TEXT NOT NULL,
+                                            UNIQUE (url, name));
+CREATE TABLE IF NOT EXISTS journals (seq INTEGER PRIMARY KEY,
+                                     name TEXT UNIQUE NOT NULL,
+                                     abbrev TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS journals_abbrev ON journals (abbrev);
+CREATE TABLE IF NOT EXISTS canonical (key TEXT PRIMARY KEY,
+                                       abbrev TEXT);
+CREATE TABLE IF NOT EXISTS matches (journal TEXT PRIMARY KEY,
+                                    abbrev TEXT NOT NULL,
+                                    score REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS manifest (bibfile TEXT NOT NULL,
+                                     id TEXT NOT NULL,
+                                     hash TEXT NOT NULL,
+                                     PRIMARY KEY (bibfile, id));
+'''
+
+
+class JournalStore(Mapping):
+    '''Read-only dict-like view of journal abbreviations kept in sqlite.
+
+    Opening a store does not read any journals; lookups are served by the
+    primary-key index and iteration streams rows in insertion order, which
+    is the order a dict built from the same abbreviations would have.
+
+    Every source (URL or file) is stored separately along with its ETag,
+    Last-Modified and content hash. The merged journals table is rebuilt
+    only when a source or the list of sources changes: sources are applied
+    in the order given, so a later source overrides the abbreviation of an
+    earlier one, and custom abbreviations are applied last. The canonical
+    form of every name and abbreviation (see canonical.py) is indexed along
+    with it, so getcanonical() answers most variants without fuzzy matching.
+    '''
+
+    def __init__(self, path=None):
+        self.path = path or makecachedir()
+        self.db = sqlite3.connect(self.path)
+        # Let sqlite read the file through a memory map instead of read() calls
+        self.db.execute('PRAGMA mmap_size=268435456')
+        self.db.executescript(SCHEMA)
+        if self.getmeta('version') != str(JCACHE_VERSION):
+            with self.db:
+                for _table in ('journals', 'canonical', 'matches', 'sources', 'source_journals',
+                               'manifest', 'meta'):
+                    self.db.execute('DELETE FROM %s' % _table)
+                self.setmeta('version', JCACHE_VERSION)
+
+    def __getitem__(self, key):
+        _r = self.db.execute('SELECT abbrev FROM journals WHERE name=?', (key,)).fetchone()
+        if _r is None:
+            raise KeyError(key)
+        return _r[0]
+
+    def __contains__(self, key):
+        return self.db.execute('SELECT 1 FROM journals WHERE name=?', (key,)).fetchone() is not None
+
+    def __iter__(self):
+        for _r in self.db.execute('SELECT name FROM journals ORDER BY seq'):
+            yield _r[0]
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM journals').fetchone()[0]
+
+    def items(self):
+        '''Stream (name, abbreviation) pairs without a lookup per key'''
+        return self.db.execute('SELECT name, abbrev FROM journals ORDER BY seq')
+
+    def getsource(self, url):
+        '''Return (etag, modified, sha1) stored for a source or None'''
+        return self.db.execute('SELECT etag, modified, sha1 FROM sources WHERE url=?',
+                               (url,)).fetchone()
+
+    def putsource(self, url, fetched, sha1, journals=None):
+        '''Store the validators of a source and, if given, its abbreviations'''
+        with self.db:
+            self.db.execute('INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?)',
+                            (url, fetched.etag, fetched.modified, sha1))
+            if journals is not None:
+                self.db.execute('DELETE FROM source_journals WHERE url=?', (url,))
+                self.db.executemany('INSERT INTO source_journals (url, name, abbrev) '
+                                    'VALUES (?, ?, ?)',
+                                    ((url, _t, journals[_t]) for _t in journals))
+
+    def merge(self, sources):
+        '''Rebuild the merged journals table from the stored sources'''
+        sources = list(sources)
+        with self.db:
+            self.db.execute('DELETE FROM source_journals WHERE url NOT IN (%s)' %
+                            ','.join('?'*(len(sources)+1)), sources+[CUSTOM])
+            self.db.execute('DELETE FROM sources WHERE url NOT IN (%s)' %
+                            ','.join('?'*len(sources)), sources)
+            self.db.execute('DELETE FROM journals')
+            for url in sources+[CUSTOM]:
+                self.db.execute('INSERT INTO journals (name, abbrev) '
+                                'SELECT name, abbrev FROM source_journals '
+                                'WHERE url=? ORDER BY seq '
+                                'ON CONFLICT(name) DO UPDATE SET abbrev=excluded.abbrev',
+                                (url,))
+            with PROFILER.stage('build canonical index'):
+                self.db.execute('DELETE FROM canonical')
+                self.db.executemany('INSERT INTO canonical VALUES (?, ?)',
+                                    buildindex(list(self.items())).items())
+            self.setmeta('sources', '\n'.join(sources))
+            self.db.execute("DELETE FROM meta WHERE key='fingerprint'")
+
+    def addcustom(self, journals):
+        '''Add or replace custom abbreviations; replaced names keep their position'''
+        with self.db:
+            self.db.executemany('INSERT INTO source_journals (url, name, abbrev) VALUES (?, ?, ?) '
+                                'ON CONFLICT(url, name) DO UPDATE SET abbrev=excluded.abbrev',
+                                ((CUSTOM, _t, journals[_t]) for _t in journals))
+            self.db.executemany('INSERT INTO journals (name, abbrev) VALUES (?, ?) '
+                                'ON CONFLICT(name) DO UPDATE SET abbrev=excluded.abbrev',
+                                journals.items())
+            # Custom abbreviations win, as they do in the journals table
+            self.db.executemany('INSERT INTO canonical VALUES (?, ?) '
+                                'ON CONFLICT(key) DO UPDATE SET abbrev=excluded.abbrev',
+                                ((_k, _a) for _t, _a in journals.items()
+                                 for _k in (canonical(_t), canonical(_a)) if _k))
+            self.db.execute("DELETE FROM meta WHERE key='fingerprint'")
+
+    def getname(self, abbrev):
+        '''Return the first full name abbreviated as abbrev, or None'''
+        _r = self.db.execute('SELECT name FROM journals WHERE abbrev=? ORDER BY seq LIMIT 1',
+                             (abbrev,)).fetchone()
+        return _r[0] if _r else None
+
+    def getcanonical(self, journal):
+        '''Return the only abbreviation whose canonical form is that of journal, or None'''
+        _r = self.db.execute('SELECT abbrev FROM canonical WHERE key=?',
+                             (canonical(journal),)).fetchone()
+        return _r[0] if _r else None
+
+    def getmeta(self, key):
+        '''Return a value from the meta table or None'''
+        _r = self.db.execute('SELECT value FROM meta WHERE key=?', (key,)).fetchone()
+        return _r[0] if _r else None
+
+    def setmeta(self, key, value):
+        '''Store a value in the meta table'''
+        self.db.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, str(value)))
+
+    def fingerprint(self):
+        '''Return the fingerprint of the stored journals, computing it only once'''
+        _fp = self.getmeta('fingerprint')
+        if _fp is None:
+            _fp = fingerprint(dict(self.items()))
+            with self.db:
+                self.setmeta('fingerprint', _fp)
+        return _fp
+
+    def close(self):
+        '''Close the underlying database'''
+        self.db.close()
+
+
+def makecachedir():
+    '''Create CACHEDIR if it does not exist, falling back to the temp dir, and return JCACHE'''
+    global CACHEDIR, JCACHE #pylint: disable=W0603
+    if not os.path.exists(CACHEDIR):
+        try:
+            # Create it if it doesn't exist
+            os.makedirs(CACHEDIR)
+        except OSError:
+            # Fall back to global tempdir
+            CACHEDIR = tempfile.gettempdir()
+            JCACHE = os.path.join(CACHEDIR,'journal_abbreviations.db')
+    return JCACHE
+
+
+def fetchhttp(url, etag=None, modified=None):
+    '''Conditional GET of url; returns None if the server says it has not changed'''
+    downloads = os.path.join(os.path.dirname(makecachedir()), 'bibtexcleaner-downloads')
+    os.makedirs(downloads, exist_ok=True)
+    # Named after the URL so an interrupted download is resumed on the next run
+    dest = os.path.join(downloads, hashlib.sha1(url.encode('utf8')).hexdigest())
+    return fetcher.download(url, dest, etag, modified)
+
+def fetchfile(url, etag=None, modified=None): #pylint: disable=W0613
+    '''Read a local file (path or file:// URL); unchanged if its mtime is the same'''
+    path = urllib.parse.urlsplit(url).path if url.startswith('file:') else url
+    try:
+        _mtime = str(os.stat(path).st_mtime_ns)
+        if _mtime == modified:
+            return None
+    except OSError as msg:
+        raise FetchError(str(msg)) from msg
+    return Fetched(__iterfile(path), None, _mtime)
+
+def __iterfile(path):
+    '''Yield the lines of a file, keeping it open only while iterating'''
     try:
-        # Create it if it doesn't exist
-        os.makedirs(CACHEDIR)
+        with open(path, encoding='utf8') as fh:
+            for _l in fh:
+                yield _l
     except OSError as msg:
-        # Fall back to global tempdir
-        CACHEDIR = tempfile.gettempdir()
-JCACHE=os.path.join(CACHEDIR,'journal_abbreviations.cache')
+        raise FetchError(str(msg)) from msg
+
+# Fetchers by URL scheme; anything without a registered scheme is a local path
+FETCHERS = {'http': fetchhttp,
+            'https': fetchhttp,
+            'file': fetchfile,
+            '': fetchfile}
+
+def register_fetcher(scheme, fetcher):
+    '''Use fetcher(url, etag, modified) for URLs starting with scheme:'''
+    FETCHERS[scheme] = fetcher
+
+def fetch(url, etag=None, modified=None):
+    '''Fetch url with the fetcher registered for its scheme'''
+    scheme = urllib.parse.urlsplit(url).scheme.lower()
+    return FETCHERS.get(scheme, FETCHERS[''])(url, etag, modified)
+
+def fetchmany(sources):
+    '''Fetch [(url, etag, modified)] at the same time, fetcher.JOBS at a time.
+
+    Returns {url: what fetch() returned, or the FetchError it raised}.
+    '''
+    if len(sources) < 2:
+        return {url: __tryfetch(url, etag, modified) for url, etag, modified in sources}
+    # Only needed with several sources
+    from concurrent.futures import ThreadPoolExecutor  #pylint: disable=C0415
+    with ThreadPoolExecutor(min(fetcher.JOBS, len(sources))) as pool:
+        futures = [(url, pool.submit(__tryfetch, url, etag, modified))
+                   for url, etag, modified in sources]
+        return {url: future.result() for url, future in futures}
+
+def __tryfetch(url, etag, modified):
+    '''Return fetch(url, etag, modified), or the FetchError it raised'''
+    try:
+        return fetch(url, etag, modified)
+    except FetchError as msg:
+        return msg
 
 
 def refreshcache():
     '''Delete the disk cache'''
-    if os.path.exists(JCACHE):
-        os.remove(JCACHE)
+    for _f in (JCACHE, LEGACY_JCACHE, LEGACY_MCACHE):
+        if os.path.exists(_f):
+            os.remove(_f)
 
-def getcache(database, _custom=None):
-    '''Fetch journals from disk cache.'''
-    # custom = _custom or {}
-    journals = {}
-    if not os.path.exists(JCACHE):
-        print('%sFetching list of common journal abbreviations.' % Fore.YELLOW)
-        _r = requests.get(database)
-        if _r.status_code != 200:
-            print("%sError fetching journal abbreviations with code %s" %\
-                (Fore.RED,str(_r.status_code)) )
-        else:
-            journals = __parseabbreviations(_r.text.split('\n'))
-    else:
+def getcache(databases, _custom=None, refresh=False):
+    '''Fetch journals from disk cache, fetching sources that are not cached.
+
+    Sources are fetched at the same time (see fetchmany) and then parsed
+    in order. A source that cannot be fetched keeps its cached copy, so
+    going offline only means the cache is not brought up to date. A cache
+    that cannot be opened is deleted and built again.
+    '''
+    if isinstance(databases, str):
+        databases = [databases]
+    try:
+        journals = JournalStore()
+    except sqlite3.Error:
+        print('%sError loading cache from %s, starting a new one.' % (Fore.RED,JCACHE))
+        refreshcache()
         try:
-            journals = pickle.load(open(JCACHE,'rb'))
-            print('%sRead journal abbreciations from %s.' % (Fore.YELLOW,JCACHE))
-        except OSError:
+            journals = JournalStore()
+        except sqlite3.Error:
             print('%sError loading cache from %s.' % (Fore.RED,JCACHE))
             return {}
-    if _custom is not None:
-        journals.update(__parseabbreviations(_custom))
+    pending = []
+    for url in databases:
+        _row = journals.getsource(url)
+        if _row is None or refresh:
+            print('%sFetching journal abbreviations from %s.' % (Fore.YELLOW, url))
+            pending.append((url, _row))
+    with PROFILER.stage('fetch abbreviations'):
+        fetched = fetchmany([(url, _row[0], _row[1]) if _row else (url, None, None)
+                             for url, _row in pending])
+    changed = False
+    for url, _row in pending:
+        changed = __syncsource(journals, url, _row, fetched[url]) or changed
+    if changed or journals.getmeta('sources') != '\n'.join(databases):
+        journals.merge(databases)
+    if len(journals):
+        print('%sRead journal abbreciations from %s.' % (Fore.YELLOW,JCACHE))
+    else:
+        print('%sNo journal abbreviations could be loaded.' % Fore.RED)
+    if _custom:
+        addcustom(journals, _custom)
     return journals
 
-def putcache(journals):
-    '''Save cache to disk'''
+def addcustom(journals, _custom):
+    '''Parse custom abbreviations, add them to journals (a JournalStore or a dict) and save them'''
+    custom = parseabbreviations(_custom)
+    for _t in custom:
+        print("%sAdding custom journal %s%s => %s" % (
+            Style.BRIGHT+Fore.CYAN, Fore.WHITE, _t, custom[_t]))
+    if isinstance(journals, JournalStore):
+        # Every change to a JournalStore is committed right away
+        journals.addcustom(custom)
+    else:
+        journals.update(custom)
+        putcustom(custom)
+    return custom
+
+def putcustom(custom):
+    '''Save custom abbreviations to disk, where they override those of every source.
+
+    Only for abbreviations given by the user: a whole downloaded list saved
+    this way would override every database and never be refreshed.
+    '''
     try:
-        pickle.dump(journals,open(JCACHE,'wb'))
-        print('%sSaved cache to %s' % (Fore.YELLOW,JCACHE))
-    except OSError:
+        store = JournalStore()
+        store.addcustom(custom)
+        store.close()
+        print('%sSaved custom abbreviations to %s' % (Fore.YELLOW,JCACHE))
+    except sqlite3.Error:
         print('%sError saving cache to %s' % (Fore.RED,JCACHE))
 
-def __parseabbreviations(jlines):
-    '''Parse abbreviations in the format full name;abbreviation'''
+def __syncsource(store, url, row, fetched):
+    '''Store what fetch() returned for one source, returning True if its abbreviations changed'''
+    etag, modified, sha1 = row if row else (None, None, None)
+    _h = hashlib.sha1()
+    try:
+        if isinstance(fetched, FetchError):
+            raise fetched
+        if fetched is None:
+            print('%s%s has not changed.' % (Fore.YELLOW, url))
+            return False
+        with PROFILER.stage('parse abbreviations'):
+            # Hash the body on the way through the parser
+            journals = parseabbreviations(__hashlines(fetched.lines, _h))
+    except FetchError as msg:
+        print('%sError fetching journal abbreviations: %s' % (Fore.RED, str(msg)))
+        if row:
+            print('%sKeeping the cached copy of %s.' % (Fore.YELLOW, url))
+        return False
+    if _h.hexdigest() == sha1:
+        store.putsource(url, fetched, sha1)
+        return False
+    store.putsource(url, fetched, _h.hexdigest(), journals)
+    return True
+
+def __hashlines(lines, _h):
+    '''Pass lines through, adding each one to the hash _h'''
+    for _l in lines:
+        _h.update(_l.encode('utf8'))
+        yield _l
+
+def fingerprint(journals):
+    '''Return a hash of the journal dict, including the order of its keys'''
+    if isinstance(journals, JournalStore):
+        return journals.fingerprint()
+    _h = hashlib.sha1()
+    for key in journals:
+        _h.update(('%s\0%s\n' % (key, journals[key])).encode('utf8'))
+    return _h.hexdigest()
+
+def getmatchcache(journals):
+    '''Fetch match results from disk if they were scored against journals'''
+    matches = {}
+    try:
+        store = JournalStore()
+    except sqlite3.Error:
+        print('%sError loading match cache from %s.' % (Fore.RED,JCACHE))
+        return matches
+    try:
+        if store.getmeta('matches') == fingerprint(journals):
+            for _j, _a, _s in store.db.execute('SELECT journal, abbrev, score FROM matches'):
+                matches[_j] = [_a, _s]
+            print('%sRead %s cached matches from %s.' % (Fore.YELLOW,len(matches),JCACHE))
+    except sqlite3.Error:
+        print('%sError loading match cache from %s.' % (Fore.RED,JCACHE))
+    finally:
+        store.close()
+    return matches
+
+def putmatchcache(matches, journals):
+    '''Save match results to disk along with the fingerprint of journals'''
+    _fp = fingerprint(journals)
+    try:
+        store = JournalStore()
+    except sqlite3.Error:
+        print('%sError saving match cache to %s' % (Fore.RED,JCACHE))
+        return
+    try:
+        with store.db:
+            if store.getmeta('matches') != _fp:
+                store.db.execute('DELETE FROM matches')
+                store.setmeta('matches', _fp)
+            store.db.executemany('INSERT OR REPLACE INTO matches VALUES (?, ?, ?)',
+                                 ((_j, matches[_j][0], matches[_j][1]) for _j in matches))
+        print('%sSaved %s matches to %s' % (Fore.YELLOW,len(matches),JCACHE))
+    except sqlite3.Error:
+        print('%sError saving match cache to %s' % (Fore.RED,JCACHE))
+    finally:
+        store.close()
+
+def getmanifest(bibfile, journals):
+    '''Fetch the entry hashes saved for bibfile if it was cleaned against journals'''
+    bibfile = os.path.abspath(bibfile)
+    manifest = {}
+    try:
+        store = JournalStore()
+    except sqlite3.Error:
+        print('%sError loading manifest from %s.' % (Fore.RED,JCACHE))
+        return manifest
+    try:
+        if store.getmeta('manifest:'+bibfile) == fingerprint(journals):
+            for _id, _h in store.db.execute('SELECT id, hash FROM manifest WHERE bibfile=?',
+                                            (bibfile,)):
+                manifest[_id] = _h
+    except sqlite3.Error:
+        print('%sError loading manifest from %s.' % (Fore.RED,JCACHE))
+    finally:
+        store.close()
+    return manifest
+
+def putmanifest(bibfile, hashes, journals):
+    '''Save the hashes of the entries written to bibfile and the fingerprint of journals'''
+    bibfile = os.path.abspath(bibfile)
+    _fp = fingerprint(journals)
+    try:
+        store = JournalStore()
+    except sqlite3.Error:
+        print('%sError saving manifest to %s' % (Fore.RED,JCACHE))
+        return
+    try:
+        with store.db:
+            store.db.execute('DELETE FROM manifest WHERE bibfile=?', (bibfile,))
+            store.db.executemany('INSERT OR REPLACE INTO manifest VALUES (?, ?, ?)',
+                                 ((bibfile, _id, hashes[_id]) for _id in hashes))
+            store.setmeta('manifest:'+bibfile, _fp)
+    except sqlite3.Error:
+        print('%sError saving manifest to %s' % (Fore.RED,JCACHE))
+    finally:
+        store.close()
+
+def parseabbreviations(jlines):
+    '''Parse abbreviations from an iterable of lines, one journal per line.
+
+    Lines are either "full name;abbreviation" with optional quoting and
+    extra columns (the JabRef csv format) or "full name = abbreviation".
+    A name with a parenthetical suffix, e.g. "Journal (London)", is also
+    added without it. Lines are consumed one at a time, so jlines can be a
+    stream that is still being downloaded.
+    '''
     journals = {}
+    n_lines, n_skipped = 0, 0
     for _l in jlines:
-        _t, _a = None, None
-        for _delim in (';', '='):
-            try:
-                _t,_a = _l.split(_delim)
-            except ValueError:
-                continue
-        if _t is None or _a is None:
+        n_lines += 1
+        _l = _l.strip()
+        if not _l or _l[0] == '#':
+            n_skipped += 1
+            continue
+        if ';' in _l:
+            if '"' in _l:
+                _f = next(csv.reader((_l,), delimiter=';'))
+            else:
+                _f = _l.split(';')
+        else:
+            _f = _l.split('=', 1)
+        if len(_f) < 2 or not _f[0].strip() or not _f[1].strip():
+            n_skipped += 1
             continue
-        journals[_t.strip()] = _a.strip()
-        if len(_t.split('(')) > 1:
+        _t, _a = _f[0].strip(), _f[1].strip()
+        journals[_t] = _a
+        if '(' in _t:
             journals[_t.split('(')[0].strip()] = _a.split('(')[0].strip()
-        print("%sAdding custom journal %s%s => %s" % (
-                Style.BRIGHT+Fore.CYAN, Fore.WHITE, _t, _a))
+    print('%sParsed %s journal abbreviations from %s lines (%s skipped).' % (
+            Fore.CYAN, len(journals), n_lines, n_skipped))
     return journals
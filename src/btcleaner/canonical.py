@@ -0,0 +1,54 @@
+'''Canonical forms of journal names, so that spelling variants are exact hits'''
+import re
+import unicodedata
+
+# Words that do not tell two journal titles apart; single letters are kept
+# because they do, e.g. "Phys. Rev. A" and "Phys. Rev. B"
+STOPWORDS = frozenset(('the', 'of', 'and', 'in', 'for', 'on', 'an', 'at', 'to',
+                       'de', 'des', 'du', 'der', 'die', 'und', 'et', 'la', 'le'))
+# LaTeX commands that are letters rather than accents on the next letter
+LATEXLETTERS = {'o':'o', 'O':'o', 'l':'l', 'L':'l', 'i':'i', 'j':'j', 'ss':'ss',
+                'ae':'ae', 'AE':'ae', 'oe':'oe', 'OE':'oe', 'aa':'a', 'AA':'a'}
+# The same letters in unicode, after case folding
+UNICODELETTERS = str.maketrans({'ø':'o', 'ł':'l', 'ı':'i', 'æ':'ae', 'œ':'oe', 'đ':'d'})
+# Braces only group, a tie is a space
+GROUPING = str.maketrans({'{':None, '}':None, '~':' '})
+LATEXCMD = re.compile(r'\\(?:([a-zA-Z]+)\s*|(.))')
+PUNCTUATION = re.compile(r'[^\w\s]|_')
+
+
+def canonical(journal):
+    '''Reduce a journal name to its canonical form.
+
+    The form is case folded, with LaTeX commands, braces, accents,
+    punctuation and STOPWORDS removed, so "J. Phys. Chem. C",
+    "J Phys Chem C" and "{J}.~{P}hys. {C}hem. {C}" are the same, as are
+    "The Journal of Physical Chemistry C" and "Journal of physical chemistry C".
+    '''
+    if '\\' in journal:
+        journal = LATEXCMD.sub(__latexletter, journal)
+    journal = journal.translate(GROUPING).casefold()
+    if not journal.isascii():
+        journal = ''.join(_c for _c in unicodedata.normalize('NFKD', journal)
+                          if not unicodedata.combining(_c)).translate(UNICODELETTERS)
+    return ' '.join(_w for _w in PUNCTUATION.sub(' ', journal).split() if _w not in STOPWORDS)
+
+def __latexletter(match):
+    '''Replace a LaTeX command with the letter it stands for, if any'''
+    if match.group(1):
+        return LATEXLETTERS.get(match.group(1), '')
+    return '' if match.group(2).isalnum() or match.group(2) in '\'"`^~=.' else ' '
+
+def buildindex(journals):
+    '''Return {canonical form: abbreviation} of (name, abbreviation) pairs.
+
+    Both the name and the abbreviation of a journal are indexed. A form
+    shared by journals with different abbreviations maps to None, because
+    it cannot tell them apart.
+    '''
+    index = {}
+    for name, abbrev in journals:
+        for _k in (canonical(name), canonical(abbrev)):
+            if _k and index.setdefault(_k, abbrev) != abbrev:
+                index[_k] = None
+    return index
@@ -0,0 +1,81 @@
+'''A cleaner that loads journal abbreviations once and cleans many databases'''
+import sys
+
+try:
+    import bibtexparser
+    from bibtexparser.bparser import BibTexParser
+    from bibtexparser.bwriter import BibTexWriter
+    from colorama import Fore
+
+except ImportError as msg:
+    print("Error importing package: %s" % str(msg))
+    sys.exit(1)
+
+from . import cache, dedupe
+from .matcher import JournalMatcher
+from .recordhandler import RecordHandler
+from .profiler import PROFILER
+
+
+class Cleaner():
+    '''Journal abbreviations, their matcher and match results kept warm between cleans.
+
+    Loading the abbreviations and building the matcher are by far the
+    slowest part of a small clean, so a Cleaner does them once and every
+    call to clean() or cleanstring() reuses them. Each clean gets its own
+    RecordHandler, so stats and answers do not leak from one to the next,
+    but match results are shared and only scored once.
+    '''
+
+    def __init__(self, databases, _custom=None, _refresh=False):
+        self.databases = databases
+        with PROFILER.stage('load journals'):
+            # Falls back to the cached copy of a source that cannot be fetched
+            self.journals = cache.getcache(databases, _custom, _refresh)
+        with PROFILER.stage('load match cache'):
+            self.matches = cache.getmatchcache(self.journals)
+        self.matcher = None
+
+    def warm(self):
+        '''Build the matcher now instead of on the first unknown journal'''
+        if self.matcher is None:
+            self.matcher = JournalMatcher(self.journals)
+        return self
+
+    def getrecordhandler(self, decisions=None, manifest=None):
+        '''Return a RecordHandler for one clean that shares the warm state'''
+        records = RecordHandler(self.journals, self.matches, decisions, manifest)
+        records.matcher = self.matcher
+        return records
+
+    def clean(self, bib_database, decisions=None, jobs=1, dodedupe=True):
+        '''Clean and dedupe the entries of bib_database in place and return its RecordHandler'''
+        records = self.getrecordhandler(decisions)
+        bib_database.entries = records.handle_records(bib_database.entries, jobs)
+        # Keep the matcher if the handler had to build it
+        self.matcher = records.matcher
+        if dodedupe:
+            bib_database.entries = dedupe.dodupecheck(bib_database, decisions)
+        return records
+
+    def cleanstring(self, bibtex, decisions=None, jobs=1, dodedupe=True):
+        '''Clean a string of BibTeX and return the cleaned string and its RecordHandler'''
+        with PROFILER.stage('parse'):
+            bib_database = bibtexparser.loads(bibtex, parser=BibTexParser(common_strings=True))
+        records = self.clean(bib_database, decisions, jobs, dodedupe)
+        with PROFILER.stage('write'):
+            return BibTexWriter().write(bib_database), records
+
+    def save(self, records=None):
+        '''Store the match results and any custom abbreviations learned by records'''
+        with PROFILER.stage('save cache'):
+            # Under the fingerprint of the journals they were scored against
+            cache.putmatchcache(self.matches, self.journals)
+            unique = records.getcustom() if records is not None else []
+            if unique:
+                # Into the store that is already open rather than a new connection to it
+                cache.addcustom(self.journals, unique)
+                print('%sCached %s custom abbreviations.' % (Fore.YELLOW, len(unique)))
+                # A custom may be a better match for any journal, so score them all again
+                self.matches.clear()
+                self.matcher = None
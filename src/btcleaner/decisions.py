@@ -0,0 +1,106 @@
+'''Record and replay the answers to prompts so the cleaner can run unattended'''
+import sys
+import json
+
+try:
+    from colorama import Fore
+
+except ImportError as msg:
+    print("Error importing package: %s" % str(msg))
+    sys.exit(1)
+
+# Bump this when the layout of the decisions file changes
+DECISIONS_VERSION = 1
+
+
+class Decisions():
+    '''Answers to the questions the cleaner would otherwise ask with input().
+
+    A decisions file is JSON with two lists. Each entry of "journals" has
+    the original "journal", the best "suggestion" and its "score", and a
+    "replace" field: null (undecided), true (use the suggestion), false or
+    "" (leave the journal alone) or a string to use instead. Each entry of
+    "duplicates" lists the duplicate "entries" and a "keep" field: null
+    (undecided), "all" or the ID of the entry to keep.
+
+    In batch mode undecided questions are not asked; they are collected and
+    written back out so they can be reviewed and replayed with --apply.
+    '''
+
+    def __init__(self, batch=False):
+        self.batch = batch
+        self.journals = {}
+        self.duplicates = {}
+        self.unresolved = {'journals':[], 'duplicates':[]}
+        self.pendingjournals = set()
+
+    def read(self, fn):
+        '''Load reviewed decisions from a file written by write()'''
+        with open(fn, encoding='utf8') as fh:
+            self.update(json.load(fh), fn)
+
+    def update(self, _d, source='request'):
+        '''Load reviewed decisions from the parsed contents of a decisions file'''
+        if _d.get('version') != DECISIONS_VERSION:
+            print('%s%s is not a version %s decisions file.' % (Fore.RED, source, DECISIONS_VERSION))
+            return
+        for _j in _d.get('journals', []):
+            if _j.get('replace') is not None:
+                self.journals[_j['journal']] = _j
+        for _g in _d.get('duplicates', []):
+            if _g.get('keep') is not None:
+                self.duplicates[self.__groupkey(_g['entries'])] = _g['keep']
+        print('%sRead %s journal and %s duplicate decisions from %s.' % (
+            Fore.YELLOW, len(self.journals), len(self.duplicates), source))
+
+    def questions(self):
+        '''Return every unresolved question in the layout of a decisions file'''
+        return {'version':DECISIONS_VERSION,
+                'journals':self.unresolved['journals'],
+                'duplicates':self.unresolved['duplicates']}
+
+    def write(self, fn):
+        '''Write every unresolved question to fn'''
+        with open(fn, 'w', encoding='utf8') as fh:
+            json.dump(self.questions(), fh, indent=2, ensure_ascii=False)
+        print('%sWrote %s journal and %s duplicate questions to %s.' % (
+            Fore.YELLOW, len(self.unresolved['journals']),
+            len(self.unresolved['duplicates']), fn))
+
+    def journal(self, journal, suggestion, score):
+        '''Return the replacement for journal, False to keep it or None to ask'''
+        if journal in self.journals:
+            replace = self.journals[journal]['replace']
+            if replace is True:
+                return suggestion
+            return replace or False
+        if self.batch:
+            self.pendingjournals.add(journal)
+            self.unresolved['journals'].append({'journal':journal,
+                                                'suggestion':suggestion,
+                                                'score':round(score, 4),
+                                                'replace':None})
+            return False
+        return None
+
+    def pending(self, journal):
+        '''Return True if the question about journal was left open in this run'''
+        return journal in self.pendingjournals
+
+    def duplicate(self, entries):
+        '''Return the ID to keep from a group of duplicates, 'all' or None to ask'''
+        _key = self.__groupkey(entries)
+        if _key in self.duplicates:
+            return self.duplicates[_key]
+        if self.batch:
+            self.unresolved['duplicates'].append({'entries':[
+                {_f:_e.get(_f, '') for _f in ('ID', 'title', 'journal', 'volume',
+                                              'pages', 'doi')}
+                for _e in entries], 'keep':None})
+            return 'all'
+        return None
+
+    @staticmethod
+    def __groupkey(entries):
+        '''Identify a group of duplicates by the sorted IDs of its entries'''
+        return tuple(sorted(_e['ID'] for _e in entries))
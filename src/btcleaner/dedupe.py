@@ -1,66 +1,178 @@
 '''Deduping functions'''
 
 import sys
+import re
 
 try:
-    from colorama import init,Fore,Style,Back
+    import Levenshtein #pip3 install python-levenshtein
+    from colorama import Fore,Style,Back
 
 except ImportError as msg:
     print("Error importing package: %s" % str(msg))
     sys.exit(1)
 
-# Setup colors
-init(autoreset=True)
+from .profiler import PROFILER
 
-def dodupecheck(bib_database):
-    '''Check for duplicate bibtex entries'''
-    dedupe = []
-    dupes = {}
-    for record in bib_database.entries:
-        try:
-            _p = record['pages'].split('-')[0].strip().strip('-')
-            _j, _v, _id = record['journal'], record['volume'], record['ID']
-            if _p and _v:
-                dedupe.append( (_p, _v, _j, _id) )
-        except KeyError:
+# Titles of entries by the same first author in the same year that are at
+# least this similar are treated as the same paper
+TITLE_THRESHOLD = 0.9
+# Blocks larger than this are too generic to compare pairwise
+MAXBLOCK = 200
+
+def dupekey(record):
+    '''Return the normalized (first page, volume) of a record or None'''
+    if 'journal' not in record:
+        return None
+    try:
+        _p = record['pages'].split('-')[0].strip().strip('-')
+        _v = record['volume']
+    except KeyError:
+        return None
+    _p = _p.replace('{', '').replace('}', '').strip().lower()
+    _v = _v.replace('{', '').replace('}', '').strip().lower()
+    if _p and _v:
+        return (_p, _v)
+    return None
+
+def findgroups(entries):
+    '''Group entries that share a dupekey in one pass; returns groups of two or more'''
+    groups = {}
+    for record in entries:
+        _k = dupekey(record)
+        if _k is not None:
+            groups.setdefault(_k, []).append(record)
+    return [_g for _g in groups.values() if len(_g) > 1]
+
+def normdoi(record):
+    '''Return the bare, lower case DOI of a record or an empty string'''
+    _d = record.get('doi', '').strip().lower()
+    _d = re.sub(r'^(https?://)?(dx\.)?doi\.org/|^doi:\s*', '', _d)
+    return _d.strip('{} ')
+
+def normtitle(record):
+    '''Return the title of a record without case, braces, LaTeX commands or punctuation'''
+    _t = re.sub(r'\\[a-zA-Z]+|[^\w\s]', ' ', record.get('title', '').lower())
+    return ' '.join(_t.split())
+
+def firstauthor(record):
+    '''Return the lower case surname of the first author of a record'''
+    _a = record.get('author', '').split(' and ')[0].replace('{', '').replace('}', '')
+    if ',' in _a:
+        _a = _a.split(',')[0]
+    elif _a.split():
+        _a = _a.split()[-1]
+    return re.sub(r'[^\w]', '', _a.lower())
+
+def findfuzzygroups(entries):
+    '''Group entries that are the same paper even if pages or volume differ.
+
+    Entries are blocked by DOI, by normalized title and by first author and
+    year, so only entries that share a block are ever compared. The same DOI
+    is a match; the same normalized title is only a match for the same first
+    author and year, since short titles are shared by different papers, and
+    within an author/year block the titles must score at least
+    TITLE_THRESHOLD. Blocks larger than MAXBLOCK are skipped. Returns groups
+    of two or more.
+    '''
+    blocks = {}
+    authoryear = []
+    for i, record in enumerate(entries):
+        _d = normdoi(record)
+        if _d:
+            blocks.setdefault(('doi', _d), []).append(i)
+        _t = normtitle(record)
+        if _t:
+            blocks.setdefault(('title', _t), []).append(i)
+        _a, _y = firstauthor(record), record.get('year', '').strip()
+        authoryear.append((_a, _y) if _a and _y else None)
+        if _a and _y and _t:
+            blocks.setdefault(('author', _a, _y), []).append(i)
+    parent = list(range(len(entries)))
+    for key, block in blocks.items():
+        if len(block) < 2 or len(block) > MAXBLOCK:
             continue
-    while dedupe:
-        # Pop a dedupe tuple off the list
-        _e = dedupe.pop()
-        for _c in dedupe:
-            # See if it overlaps with tuples in the list
-            if _e[0:2] == _c[0:2]:
-                # Create a dictionary of lsts of potential dupes keyed by ID
-                if _e[-1] in dupes:
-                    dupes[_e[-1]].append(_c)
-                else:
-                    dupes[_e[-1]] = [_c]
-    if dupes:
-        return dodedupe(bib_database, dupes)
-    return bib_database.entries
-
-def dodedupe(bib_database, dupes):
+        if key[0] == 'doi':
+            for i in block[1:]:
+                __union(parent, block[0], i)
+        elif key[0] == 'title':
+            for _x in range(len(block)):
+                for _y in range(_x+1, len(block)):
+                    _ay = authoryear[block[_x]]
+                    if _ay is not None and _ay == authoryear[block[_y]]:
+                        __union(parent, block[_x], block[_y])
+        else:
+            titles = [normtitle(entries[i]) for i in block]
+            for _x in range(len(block)):
+                for _y in range(_x+1, len(block)):
+                    if Levenshtein.ratio(titles[_x], titles[_y]) >= TITLE_THRESHOLD: #pylint: disable=E1101
+                        __union(parent, block[_x], block[_y])
+    return __collect(entries, parent)
+
+def mergegroups(entries, *groupings):
+    '''Merge several lists of groups of entries into clusters that do not overlap'''
+    index = {id(_e):i for i, _e in enumerate(entries)}
+    parent = list(range(len(entries)))
+    for groups in groupings:
+        for group in groups:
+            for _e in group[1:]:
+                __union(parent, index[id(group[0])], index[id(_e)])
+    return __collect(entries, parent)
+
+def __find(parent, i):
+    '''Find the root of i in a union-find forest, halving paths on the way'''
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+def __union(parent, i, j):
+    '''Join the sets of i and j, keeping the lower index as the root'''
+    _i, _j = __find(parent, i), __find(parent, j)
+    if _i != _j:
+        parent[max(_i, _j)] = min(_i, _j)
+
+def __collect(entries, parent):
+    '''Return the sets of a union-find forest with two or more entries, in file order'''
+    groups = {}
+    for i, _e in enumerate(entries):
+        groups.setdefault(__find(parent, i), []).append(_e)
+    return [_g for _g in groups.values() if len(_g) > 1]
+
+def dodupecheck(bib_database, decisions=None):
+    '''Check for duplicate bibtex entries'''
+    with PROFILER.stage('dedupe'):
+        groups = mergegroups(bib_database.entries,
+                             findgroups(bib_database.entries),
+                             findfuzzygroups(bib_database.entries))
+        if groups:
+            return dodedupe(bib_database, groups, decisions)
+        return bib_database.entries
+
+def dodedupe(bib_database, groups, decisions=None):
     '''Function that does the actual deduping'''
     print('\nPossible dupes:\n')
-    clean = bib_database.entries
-    for _id in dupes:
-        # dupe is a tuple (pages, volume, journal, ID)
-        dupe = dupes[_id]
-        i = 1
-        dupelist = { str(i):bib_database.entries_dict[_id]  }
-        for _d in dupe:
-            i += 1
-            dupelist[str(i)] = bib_database.entries_dict[_d[3]]
+    # Entries are removed by identity, so entries that share an ID are safe
+    delete = set()
+    for group in groups:
+        dupelist = {}
+        for i, _d in enumerate(group):
+            dupelist[str(i+1)] = _d
         print('\t\t# # #')
         for _n in dupelist:
-            try:
-                print('%s%s%s):   %s%s' % (Style.BRIGHT,Fore.YELLOW,_n,Fore.CYAN,dupelist[_n]['ID'])) #pylint: disable=C0301
-                print('%sJournal: %s%s%s' %(Fore.YELLOW,Style.BRIGHT,Fore.WHITE,dupelist[_n]['journal'])) #pylint: disable=C0301
-                print('%sVolume: %s%s%s' %(Fore.YELLOW,Style.BRIGHT,Fore.WHITE,dupelist[_n]['volume'])) #pylint: disable=C0301
-                print('%sPages: %s%s%s' %(Fore.YELLOW,Style.BRIGHT,Fore.WHITE,dupelist[_n]['pages']), end='\n\n') #pylint: disable=C0301
-            except KeyError as msg:
-                print("Error parsing entry: %s" % str(msg))
-        keep = input('Keep which one?  ')
+            print('%s%s%s):   %s%s' % (Style.BRIGHT,Fore.YELLOW,_n,Fore.CYAN,dupelist[_n]['ID'])) #pylint: disable=C0301
+            print('%sTitle: %s%s%s' %(Fore.YELLOW,Style.BRIGHT,Fore.WHITE,dupelist[_n].get('title', '-'))) #pylint: disable=C0301
+            print('%sJournal: %s%s%s' %(Fore.YELLOW,Style.BRIGHT,Fore.WHITE,dupelist[_n].get('journal', '-'))) #pylint: disable=C0301
+            print('%sVolume: %s%s%s' %(Fore.YELLOW,Style.BRIGHT,Fore.WHITE,dupelist[_n].get('volume', '-'))) #pylint: disable=C0301
+            print('%sPages: %s%s%s' %(Fore.YELLOW,Style.BRIGHT,Fore.WHITE,dupelist[_n].get('pages', '-'))) #pylint: disable=C0301
+            print('%sDOI: %s%s%s' %(Fore.YELLOW,Style.BRIGHT,Fore.WHITE,dupelist[_n].get('doi', '-')), end='\n\n') #pylint: disable=C0301
+        keep = decisions.duplicate(list(dupelist.values())) if decisions else None
+        if keep is None:
+            with PROFILER.stage('prompt'):
+                keep = input('Keep which one?  ')
+        else:
+            for _n in dupelist:
+                if dupelist[_n]['ID'] == keep:
+                    keep = _n
         if keep not in dupelist:
             print('%sKeeping all.' % (Fore.GREEN) )
         else:
@@ -68,11 +180,7 @@ def dodedupe(bib_database, dupes):
             for _n in dupelist:
                 if _n == keep:
                     continue
-                for _c in enumerate(clean):
-                    i = _c[0]
-                    if clean[i]['ID'] == dupelist[_n]['ID']:
-                        print('%s%sDeleting%s %s%s%s' % (Fore.YELLOW,Back.RED,
-                            Style.RESET_ALL,Style.BRIGHT,Fore.RED,clean[i]['ID']))
-                        del clean[i]
-                        break
-    return clean
+                print('%s%sDeleting%s %s%s%s' % (Fore.YELLOW,Back.RED,
+                    Style.RESET_ALL,Style.BRIGHT,Fore.RED,dupelist[_n]['ID']))
+                delete.add(id(dupelist[_n]))
+    return [_e for _e in bib_database.entries if id(_e) not in delete]
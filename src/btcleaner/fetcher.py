@@ -0,0 +1,153 @@
+'''Download abbreviation lists over HTTP with timeouts, retries and resume.
+
+A download is streamed to a .part file next to its destination and only
+renamed into place when it is complete. If it is cut off, the next
+attempt (or the next run) asks the server for the rest with a Range
+request, as long as the server still has the same version of the file.
+Each thread keeps its own requests.Session, so several sources on one
+host share connections.
+'''
+import os
+import json
+import time
+import threading
+from collections import namedtuple
+
+# Seconds to wait for a connection and for each read from the server
+TIMEOUT = (10, 60)
+# Attempts after the first one, and the wait before the first retry (doubled after each)
+RETRIES = 3
+BACKOFF = 0.5
+# Sources fetched at the same time, see cache.fetchmany
+JOBS = 4
+CHUNKSIZE = 1 << 16
+
+
+class FetchError(Exception):
+    '''Raised by fetchers when a source cannot be retrieved'''
+
+class RetryError(FetchError):
+    '''A failure that may go away if the request is made again'''
+
+# What a fetcher returns: an iterator over the lines of the body and the
+# validators for the next request
+Fetched = namedtuple('Fetched', ('lines', 'etag', 'modified'))
+
+# The requests.Session of each thread
+SESSIONS = threading.local()
+
+
+def session():
+    '''Return the requests.Session of this thread, making it the first time'''
+    if getattr(SESSIONS, 'session', None) is None:
+        # Only HTTP sources need requests and it is slow to import
+        import requests  #pylint: disable=C0415
+        SESSIONS.session = requests.Session()
+    return SESSIONS.session
+
+def download(url, dest, etag=None, modified=None):
+    '''Download url to dest, retrying and resuming; return Fetched, or None if unchanged.
+
+    etag and modified are the validators of the copy already cached, for
+    a conditional GET. The lines of the returned Fetched are read from
+    dest, which is removed once they have all been read.
+    '''
+    try:
+        import requests  #pylint: disable=C0415
+    except ImportError as msg:
+        raise FetchError("Error importing package: %s" % str(msg)) from msg
+    retryable = (RetryError, requests.ConnectionError, requests.Timeout,
+                 requests.exceptions.ChunkedEncodingError)
+    for attempt in range(RETRIES + 1):
+        try:
+            return __attempt(url, dest, etag, modified)
+        except retryable as msg:
+            if attempt == RETRIES:
+                raise FetchError('%s (gave up after %s attempts)' % (str(msg), attempt+1)) from msg
+            time.sleep(BACKOFF * 2**attempt)
+        except requests.RequestException as msg:
+            raise FetchError(str(msg)) from msg
+    return None
+
+def __attempt(url, dest, etag, modified):
+    '''Make one request for url, picking up where a .part file left off'''
+    part, partinfo = dest+'.part', dest+'.part.json'
+    # A .part holds bytes as they were sent, so they must not be compressed:
+    # requests would decompress them and a Range counts compressed bytes
+    headers = {'Accept-Encoding': 'identity'}
+    if etag:
+        headers['If-None-Match'] = etag
+    if modified:
+        headers['If-Modified-Since'] = modified
+    info = __readinfo(partinfo, url)
+    offset = os.path.getsize(part) if info and os.path.exists(part) else 0
+    if offset:
+        # The rest of the file if it is still the version the .part is from
+        headers['Range'] = 'bytes=%d-' % offset
+        headers['If-Range'] = info['etag'] or info['modified']
+    with session().get(url, headers=headers, stream=True, timeout=TIMEOUT) as _r:
+        if _r.status_code == 304:
+            __discard(part, partinfo)
+            return None
+        if _r.status_code == 416:
+            # The .part is no use to the server; start again
+            __discard(part, partinfo)
+            raise RetryError('%s cannot resume a partial download' % url)
+        if _r.status_code == 429 or _r.status_code >= 500:
+            raise RetryError('%s returned code %s' % (url, _r.status_code))
+        if _r.status_code == 206 and offset and \
+           _r.headers.get('Content-Range', '').startswith('bytes %d-' % offset):
+            mode = 'ab'
+        elif _r.status_code == 200:
+            mode, offset = 'wb', 0
+            info = {'url':url, 'etag':_r.headers.get('ETag'),
+                    'modified':_r.headers.get('Last-Modified'),
+                    'encoding':_r.encoding or 'utf8'}
+            with open(partinfo, 'w') as fh:
+                json.dump(info, fh)
+        elif _r.status_code == 206:
+            __discard(part, partinfo)
+            raise RetryError('%s sent a range that was not asked for' % url)
+        else:
+            raise FetchError('%s returned code %s' % (url, _r.status_code))
+        expected = _r.headers.get('Content-Length')
+        written = 0
+        with open(part, mode) as fh:
+            for chunk in _r.iter_content(CHUNKSIZE):
+                fh.write(chunk)
+                written += len(chunk)
+        if expected is not None and written < int(expected):
+            raise RetryError('%s was cut off after %s bytes' % (url, offset + written))
+    os.replace(part, dest)
+    os.remove(partinfo)
+    return Fetched(__iterdownload(dest, info['encoding']), info['etag'], info['modified'])
+
+def __readinfo(partinfo, url):
+    '''Return what is known about a .part file, or None if there is none for url'''
+    try:
+        with open(partinfo) as fh:
+            info = json.load(fh)
+    except (OSError, ValueError):
+        return None
+    if info.get('url') != url or not (info.get('etag') or info.get('modified')):
+        # Without a validator there is no telling whether the rest would match
+        return None
+    return info
+
+def __discard(part, partinfo):
+    '''Remove a .part file and what is known about it'''
+    for _f in (part, partinfo):
+        if os.path.exists(_f):
+            os.remove(_f)
+
+def __iterdownload(path, encoding):
+    '''Yield the lines of a finished download without line endings, then remove it'''
+    try:
+        with open(path, encoding=encoding, errors='replace') as fh:
+            for _l in fh:
+                yield _l.rstrip('\r\n')
+    except OSError as msg:
+        raise FetchError(str(msg)) from msg
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
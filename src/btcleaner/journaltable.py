@@ -0,0 +1,134 @@
+'''A compact in-memory table of journal abbreviations'''
+import zlib
+from array import array
+from collections.abc import Mapping
+
+# Marks an empty slot of a hash table
+EMPTY = 0xFFFFFFFF
+
+
+class JournalTable(Mapping):
+    '''Read-only dict-like table of full name -> abbreviation in a few flat arrays.
+
+    Full names are encoded as UTF-8 and concatenated into one bytes object
+    and found by their offsets; each distinct abbreviation is stored once in
+    a second bytes object and every name refers to it by number. Names and
+    abbreviations are found through open-addressing hash tables of entry
+    numbers keyed by the CRC32 of the UTF-8 string, so the table needs no
+    dict, getname() finds the full name of an abbreviation, and a pickled
+    table (e.g. sent to worker processes) is a handful of buffers that is
+    valid in any process. Iteration is in the order the names were given; a
+    repeated name keeps its first position and its last abbreviation, as in
+    a dict.
+    '''
+
+    __slots__ = ('names', 'nameoffsets', 'abbrevs', 'abbrevoffsets', 'abbrevids',
+                 'nameslots', 'abbrevslots')
+
+    def __init__(self, journals=()):
+        if isinstance(journals, Mapping):
+            journals = journals.items()
+        # Build-time dicts are dropped as soon as the arrays are filled
+        position, abbrevs = {}, {}
+        names, ids = [], []
+        for name, abbrev in journals:
+            _a = abbrevs.setdefault(abbrev, len(abbrevs))
+            if name in position:
+                ids[position[name]] = _a
+            else:
+                position[name] = len(names)
+                names.append(name)
+                ids.append(_a)
+        del position
+        self.names, self.nameoffsets = packstrings(names)
+        self.abbrevs, self.abbrevoffsets = packstrings(abbrevs)
+        self.abbrevids = array('I', ids)
+        self.nameslots = newslots(len(names))
+        for _i in range(len(names)):
+            self.__insert(self.nameslots, self.name(_i), _i, self.name)
+        # The slot of an abbreviation holds the first entry that uses it
+        self.abbrevslots = newslots(len(abbrevs))
+        for _i in range(len(names)):
+            self.__insert(self.abbrevslots, self.entryabbrev(_i), _i, self.entryabbrev)
+
+    def __getitem__(self, key):
+        _i = self.__find(key)
+        if _i is None:
+            raise KeyError(key)
+        return self.entryabbrev(_i).decode('utf8')
+
+    def __contains__(self, key):
+        return self.__find(key) is not None
+
+    def __iter__(self):
+        for _i in range(len(self)):
+            yield self.name(_i).decode('utf8')
+
+    def __len__(self):
+        return len(self.abbrevids)
+
+    def items(self):
+        '''Return (name, abbreviation) pairs in table order'''
+        return ((self.name(_i).decode('utf8'), self.entryabbrev(_i).decode('utf8'))
+                for _i in range(len(self)))
+
+    def name(self, _i):
+        '''Return the UTF-8 full name of entry _i'''
+        return self.names[self.nameoffsets[_i]:self.nameoffsets[_i+1]]
+
+    def entryabbrev(self, _i):
+        '''Return the UTF-8 abbreviation of entry _i'''
+        _a = self.abbrevids[_i]
+        return self.abbrevs[self.abbrevoffsets[_a]:self.abbrevoffsets[_a+1]]
+
+    def getname(self, abbrev):
+        '''Return the first full name abbreviated as abbrev, or None'''
+        _i = self.__lookup(self.abbrevslots, abbrev, self.entryabbrev)
+        return None if _i is None else self.name(_i).decode('utf8')
+
+    def __find(self, key):
+        '''Return the entry of full name key or None'''
+        return self.__lookup(self.nameslots, key, self.name)
+
+    @staticmethod
+    def __insert(slots, key, _i, get):
+        '''Put entry _i in the slot of key unless an entry with the same key is there'''
+        mask = len(slots) - 1
+        _s = zlib.crc32(key) & mask
+        while slots[_s] != EMPTY:
+            if get(slots[_s]) == key:
+                return
+            _s = (_s + 1) & mask
+        slots[_s] = _i
+
+    @staticmethod
+    def __lookup(slots, key, get):
+        '''Return the entry in slots whose get() is key, or None'''
+        if not isinstance(key, str):
+            return None
+        key = key.encode('utf8')
+        mask = len(slots) - 1
+        _s = zlib.crc32(key) & mask
+        while slots[_s] != EMPTY:
+            if get(slots[_s]) == key:
+                return slots[_s]
+            _s = (_s + 1) & mask
+        return None
+
+
+def packstrings(strings):
+    '''Return strings encoded and concatenated and the offsets of their starts and end'''
+    encoded = [_s.encode('utf8') for _s in strings]
+    offsets = array('I', [0])
+    _n = 0
+    for _b in encoded:
+        _n += len(_b)
+        offsets.append(_n)
+    return b''.join(encoded), offsets
+
+def newslots(n):
+    '''Return an empty hash table for n keys: a power of two at least twice as big'''
+    size = 2
+    while size < 2*n:
+        size *= 2
+    return array('I', [EMPTY]) * size
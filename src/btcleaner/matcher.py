@@ -0,0 +1,200 @@
+'''Indexed best-match lookups of journal names against a dict of abbreviations'''
+import sys
+import re
+
+try:
+    import Levenshtein #pip3 install python-levenshtein
+
+except ImportError as msg:
+    print("Error importing package: %s" % str(msg))
+    print("try: pip3 install python-levenshtein")
+    sys.exit(1)
+
+from .profiler import PROFILER
+
+# Words too common to narrow down a list of journal titles
+STOPWORDS = ('the', 'of', 'and', 'in', 'for', 'on', 'de', 'a', 'an', 'journal', 'j')
+# Maximum number of index-selected candidates scored before the length sweep
+SHORTLIST = 16
+# Posting lists longer than this are not worth walking for a shortlist
+MAXPOSTINGS = 2000
+# Cells of the journal x candidate score matrix that matchmany computes at a time
+BATCHCELLS = 1 << 24
+# Candidates scored by cdist this close to the best are rescored exactly
+TOLERANCE = 1e-4
+
+
+def normalize(journal):
+    '''Reduce a journal name to lower case words without punctuation or braces'''
+    return ' '.join(re.sub(r'[^\w\s]', ' ', journal.lower()).split())
+
+
+def batchbackend():
+    '''Return how JournalMatcher.matchmany scores: 'cdist', 'extractone' or None'''
+    try:
+        import rapidfuzz  #pylint: disable=C0415,W0611
+    except ImportError:
+        return None
+    try:
+        import numpy  #pylint: disable=C0415,W0611
+    except ImportError:
+        return 'extractone'
+    return 'cdist'
+
+
+class JournalMatcher():
+    '''Find the abbreviation that best matches a journal name.
+
+    The result is identical to scoring Levenshtein.ratio against every
+    full name and every abbreviation in the journal dict and keeping the
+    first best hit (in dict order). Instead of scanning everything, exact and
+    normalized hits and a shortlist of candidates that share words with the
+    query are scored first, then candidates are visited in buckets of equal
+    length, skipping every bucket whose best possible ratio,
+    2*min(len)/sum(len), cannot beat the best score found so far.
+    '''
+
+    def __init__(self, _journals):
+        # Every candidate string is stored once with the abbreviation of the
+        # first journal (in dict order) that provides it, because a later one
+        # with the same string could only tie and ties go to the first hit
+        self.strings = []
+        self.abbrevs = []
+        self.exact = {}
+        self.normalized = {}
+        self.words = {}
+        self.buckets = {}
+        # Queries answered and candidates scored for them
+        self.stats = {'n_queries':0, 'n_scored':0}
+        with PROFILER.stage('build matcher'):
+            for key, abbrev in _journals.items():
+                for _s in (key, abbrev):
+                    if _s not in self.exact:
+                        self.__add(_s, abbrev)
+        self.lengths = list(self.buckets)
+
+    def __len__(self):
+        return len(self.strings)
+
+    def __add(self, _s, abbrev):
+        '''Add a candidate string to every index'''
+        _i = len(self.strings)
+        self.strings.append(_s)
+        self.abbrevs.append(abbrev)
+        self.exact[_s] = _i
+        _n = normalize(_s)
+        self.normalized.setdefault(_n, []).append(_i)
+        for _w in set(_n.split()):
+            if _w not in STOPWORDS:
+                self.words.setdefault(_w, []).append(_i)
+        self.buckets.setdefault(len(_s), []).append(_i)
+
+    def match(self, journal):
+        '''Return [abbreviation, score] of the best match for journal'''
+        self.stats['n_queries'] += 1
+        if journal in self.exact:
+            return [self.abbrevs[self.exact[journal]], 1.0]
+        best = [0, len(self.strings)]
+        scored = set()
+        for _i in self.__shortlist(journal):
+            self.__score(journal, _i, best, scored)
+        _n = len(journal)
+        bounds = []
+        for _l in self.lengths:
+            # Levenshtein.ratio can never exceed 2*min(len)/sum(len)
+            bounds.append((2*min(_n, _l)/(_n + _l) if _n + _l else 1.0, _l))
+        bounds.sort(reverse=True)
+        for _bound, _l in bounds:
+            # Small margin so a float rounding difference never drops a tie
+            if _bound < best[0] - 1e-9:
+                break
+            for _i in self.buckets[_l]:
+                if _i not in scored:
+                    self.__score(journal, _i, best, scored)
+        self.stats['n_scored'] += len(scored)
+        if not best[0]:
+            return ['', 0]
+        return [self.abbrevs[best[1]], best[0]]
+
+    def matchmany(self, journals, workers=-1):
+        '''Return {journal: [abbreviation, score]} for every journal, scored in bulk.
+
+        The results are the same as those of match(). If rapidfuzz and numpy
+        are installed, blocks of journals are scored against every candidate
+        at once by rapidfuzz.process.cdist on workers cores (-1 for all) and
+        the candidates within TOLERANCE of the best are rescored with
+        Levenshtein.ratio so ties are broken as match() breaks them. With
+        rapidfuzz alone each journal takes one extractOne call, which scores
+        the same way because Levenshtein.ratio is rapidfuzz's Indel
+        similarity. Without rapidfuzz this is match() in a loop.
+        '''
+        results = {}
+        pending = []
+        for journal in dict.fromkeys(journals):
+            if journal in self.exact or not self.strings:
+                results[journal] = self.match(journal)
+            else:
+                pending.append(journal)
+        backend = batchbackend()
+        if backend is None:
+            results.update((_j, self.match(_j)) for _j in pending)
+            return results
+        from rapidfuzz import process  #pylint: disable=C0415
+        from rapidfuzz.distance import Indel  #pylint: disable=C0415
+        self.stats['n_queries'] += len(pending)
+        self.stats['n_scored'] += len(pending) * len(self.strings)
+        if backend == 'extractone':
+            for journal in pending:
+                # The best of the shortlist lets rapidfuzz skip most candidates by length
+                best = [0, len(self.strings)]
+                for _i in self.__shortlist(journal):
+                    self.__score(journal, _i, best, set())
+                _r = process.extractOne(journal, self.strings, scorer=Indel.normalized_similarity,
+                                        score_cutoff=max(best[0] - TOLERANCE, 0))
+                results[journal] = self.__best(journal, [_r[2]] if _r and _r[1] else [])
+            return results
+        import numpy  #pylint: disable=C0415
+        rows = max(1, BATCHCELLS // len(self.strings))
+        for start in range(0, len(pending), rows):
+            block = pending[start:start+rows]
+            scores = process.cdist(block, self.strings, scorer=Indel.normalized_similarity,
+                                   dtype=numpy.float32, workers=workers)
+            for journal, row in zip(block, scores):
+                top = row.max()
+                near = numpy.flatnonzero(row >= top - TOLERANCE) if top > 0 else []
+                results[journal] = self.__best(journal, near)
+        return results
+
+    def __best(self, journal, candidates):
+        '''Return [abbreviation, score] of the best of candidates, scored exactly'''
+        best = [0, len(self.strings)]
+        scored = set()
+        for _i in candidates:
+            self.__score(journal, int(_i), best, scored)
+        if not best[0]:
+            return ['', 0]
+        return [self.abbrevs[best[1]], best[0]]
+
+    def __score(self, journal, _i, best, scored):
+        '''Score candidate _i and update best=[score, index] in place'''
+        scored.add(_i)
+        _r = Levenshtein.ratio(journal, self.strings[_i]) #pylint: disable=E1101
+        if _r > best[0] or (_r == best[0] and _r and _i < best[1]):
+            best[0], best[1] = _r, _i
+
+    def __shortlist(self, journal):
+        '''Return candidate indices likely to score well, best guesses first'''
+        _n = normalize(journal)
+        shortlist = list(self.normalized.get(_n, []))
+        hits = {}
+        for _w in set(_n.split()):
+            if _w in STOPWORDS:
+                continue
+            postings = self.words.get(_w, [])
+            if len(postings) > MAXPOSTINGS:
+                continue
+            for _i in postings:
+                hits[_i] = hits.get(_i, 0) + 1
+        ranked = sorted(hits, key=lambda _i: (-hits[_i], _i))
+        shortlist += ranked[:SHORTLIST]
+        return shortlist
@@ -0,0 +1,112 @@
+'''Wall time and call counts of each stage of a clean, for --profile'''
+import sys
+import json
+import time
+
+try:
+    from colorama import Fore,Style
+
+except ImportError as msg:
+    print("Error importing package: %s" % str(msg))
+    sys.exit(1)
+
+# Bump this when the layout of the JSON report changes
+REPORT_VERSION = 1
+
+
+class Stage():
+    '''Context manager that adds the time spent inside it to a stage of a Profiler'''
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.start = 0
+        self.children = 0
+
+    def __enter__(self):
+        self.profiler.stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        elapsed = time.perf_counter() - self.start
+        self.profiler.stack.pop()
+        if self.profiler.stack:
+            self.profiler.stack[-1].children += elapsed
+        _s = self.profiler.stages.setdefault(self.name, [0, 0.0, 0.0])
+        _s[0] += 1
+        _s[1] += elapsed
+        _s[2] += elapsed - self.children
+        return False
+
+
+class NullStage():
+    '''Stand-in for Stage when profiling is off'''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+class Profiler():
+    '''Collect the wall time and calls of named stages.
+
+    Stages nest: the total of a stage includes the stages run inside it and
+    its self time does not, so parse time does not count the cleaning that
+    bibtexparser calls back into. Until enable() is called stage() returns
+    a shared NullStage, so the instrumentation costs next to nothing.
+    Stages that run in --jobs worker processes are not seen.
+    '''
+
+    def __init__(self):
+        self.enabled = False
+        self.started = 0
+        self.stages = {}
+        self.stack = []
+        self.null = NullStage()
+
+    def enable(self):
+        '''Start recording stages'''
+        self.enabled = True
+        self.started = time.perf_counter()
+
+    def stage(self, name):
+        '''Return a context manager that times a stage called name'''
+        if self.enabled:
+            return Stage(self, name)
+        return self.null
+
+    def report(self, counters=None):
+        '''Return the stages and counters as a dict'''
+        return {'version':REPORT_VERSION,
+                'wall':time.perf_counter() - self.started,
+                'stages':{_n:{'calls':_s[0], 'total':_s[1], 'self':_s[2]}
+                          for _n, _s in self.stages.items()},
+                'counters':counters or {}}
+
+    @staticmethod
+    def printsummary(report):
+        '''Print a report as a table, slowest stages first'''
+        print('%s%-24s %8s %10s %10s %6s%s' % (Style.BRIGHT, 'Stage', 'Calls',
+              'Total (s)', 'Self (s)', 'Self', Style.RESET_ALL))
+        wall = report['wall'] or 1
+        for _n, _s in sorted(report['stages'].items(), key=lambda _i: -_i[1]['self']):
+            print('%s%-24s %s%8s %10.3f %10.3f %5.1f%%' % (Fore.CYAN, _n, Fore.WHITE,
+                  _s['calls'], _s['total'], _s['self'], 100*_s['self']/wall))
+        print('%s%-24s %8s %10.3f' % (Style.BRIGHT, 'Wall', '', report['wall']))
+        for _n, _v in report['counters'].items():
+            print('%s%-24s %s%s' % (Fore.BLUE, _n, Fore.WHITE,
+                  '%0.3f' % _v if isinstance(_v, float) else _v))
+
+    @staticmethod
+    def write(fn, report):
+        '''Write a report to fn as JSON'''
+        with open(fn, 'w', encoding='utf8') as fh:
+            json.dump(report, fh, indent=2)
+        print('%sWrote profile to %s.' % (Fore.YELLOW, fn))
+
+
+# The profiler every module reports to; enabled by --profile
+PROFILER = Profiler()
@@ -1,22 +1,22 @@
 '''The main class for parsing BiBTeX records'''
 import sys
+import json
+import hashlib
 
 try:
-    import Levenshtein #pip3 install python-levenshtein
-    from titlecase import titlecase
     from bibtexparser.customization import page_double_hyphen
-    from bibtexparser.latexenc import string_to_latex
-    from colorama import init,Fore,Style
+    from colorama import Fore,Style
 
 except ImportError as msg:
     print("Error importing package: %s" % str(msg))
-    if 'levenshtein' in str(msg).lower():
-        print("try: pip3 install python-levenshtein")
     sys.exit(1)
 
-# Setup colors
-init(autoreset=True)
-
+from .matcher import JournalMatcher, batchbackend
+from .canonical import canonical, buildindex
+from .journaltable import JournalTable
+from . import textnorm
+from .decisions import Decisions
+from .profiler import PROFILER
 
 
 def convertmonth(month_str):
@@ -46,6 +46,9 @@ def convertmonth(month_str):
             'november':11,
             'december':12}
 
+    # Already a month number, e.g. from an earlier run
+    if month_str.strip().isdigit() and 1 <= int(month_str) <= 12:
+        return str(int(month_str))
     try:
         month_num = months_abr[month_str.lower()]
     except KeyError:
@@ -56,110 +59,333 @@ def convertmonth(month_str):
     return str(month_num)
 
 
+def cleanrecord(record):
+    '''Clean the fields of a record that do not need user input.
+
+    Returns the record and whether its title was changed. This only
+    depends on the record, so it can run in a worker process.
+    '''
+    cleaned = False
+    for _key in ('pages', 'volume'):
+        if _key not in record:
+            record[_key] = ''
+    with PROFILER.stage('titlecase'):
+        cleantitle = textnorm.titlecase(record['title'])
+    if cleantitle != record['title']:
+        cleaned = True
+        record['title'] = cleantitle
+    # File entries are pointless in shared bib files
+    for key in ('file','bdsk-file-1'):
+        if key in record:
+            del record[key]
+    # Non-numeric months do not sort
+    if 'month' in record:
+        with PROFILER.stage('month'):
+            if convertmonth(record['month']):
+                record['month']=convertmonth(record['month'])
+    # Names should be separated by 'and'; comma is to reverse name/surname order
+    if 'author' in record:
+        # print(record['author'].split(','))
+        with PROFILER.stage('authors'):
+            if ' and ' not in record['author'] and ',' in record['author']:
+                authors=[]
+                for author in record['author'].split(','):
+                    authors.append('{'+author.strip()+'}')
+                record['author'] = " and ".join(authors)
+    return record, cleaned
+
+def entryhash(record):
+    '''Return a hash of every field of a record'''
+    return hashlib.sha1(json.dumps(record, sort_keys=True, default=str).encode('utf8')).hexdigest()
+
+# Matcher of a worker process, see initworker()
+WORKER_MATCHER = None
+
+def initworker(journals):
+    '''Build the matcher of a worker process once, when it starts'''
+    global WORKER_MATCHER #pylint: disable=W0603
+    WORKER_MATCHER = JournalMatcher(journals)
+
+def matchjournal(journal):
+    '''Match a journal with the matcher of a worker process'''
+    return journal, WORKER_MATCHER.match(journal)
+
+
 class RecordHandler():
     '''Handle BibTex Records for the cleaner'''
 
     recordkeys = ('ENTRYTYPE','ID','title','journal')
 
-    def __init__(self, _journals):
+    def __init__(self, _journals, _matches=None, _decisions=None, _manifest=None):
         self.journals = _journals
+        # Answers given ahead of time and the switch for unattended runs
+        self.decisions = _decisions if _decisions is not None else Decisions()
+        # Built on the first journal that is not already cached
+        self.matcher = None
         self.bib_database = None
         self.errors = []
+        # Answers given by the user or a decisions file: a replacement or None
         self.history = {}
-        self.stats = {'n_cleaned':0,
+        # Match results of earlier runs against the same journals and of this
+        # one; every result is saved for the next run, so they are all kept
+        self.stored = _matches if _matches is not None else {}
+        # Journals looked up during this run, to tell cache hits from stored results
+        self.seen = set()
+        # Match results scored ahead of time by handle_records
+        self.prescored = {}
+        # Canonical form -> abbreviation, unless _journals keeps its own
+        self.canonical = None
+        # Hashes of entries as they were written by the last run and by this one
+        self.manifest = _manifest if _manifest is not None else {}
+        self.hashes = {}
+        self.stats = {'n_skipped':0,
+                      'n_cleaned':0,
                       'n_parsed':0,
-                      'n_abbreviated':0}
+                      'n_abbreviated':0,
+                      'n_match_hits':0,
+                      'n_match_stored':0,
+                      'n_match_misses':0,
+                      'n_match_canonical':0}
 
     def handle_record(self,record):
         '''Main record handling method that gets called when bibtexparser adds an entry'''
+        with PROFILER.stage('clean record'):
+            return self.__handle(record)
+
+    def __handle(self, record):
+        '''Clean one record, see handle_record'''
+        if self.__unchanged(record):
+            return record
         for key in RecordHandler.recordkeys:
             if key not in record: # and record['ENTRYTYPE'] == 'journal':
                 print('%sCannot parse %s' % (Fore.RED,record['ENTRYTYPE']))
                 self.errors.append(record)
                 # self.clean.append(record)
                 return record
-        for _key in ('pages', 'volume'):
-            if _key not in record:
-                record[_key] = ''
-        cleantitle = titlecase(record['title'])
-        if cleantitle != record['title']:
+        record, cleaned = cleanrecord(record)
+        if cleaned:
             self.stats['n_cleaned'] += 1
-            record['title'] = cleantitle
-        # File entries are pointless in shared bib files
-        for key in ('file','bdsk-file-1'):
-            if key in record:
-                del record[key]
-        # Non-numeric months do not sort
-        if 'month' in record:
-            if convertmonth(record['month']):
-                record['month']=convertmonth(record['month'])
-        # Names should be separated by 'and'; comma is to reverse name/surname order
-        if 'author' in record:
-            # print(record['author'].split(','))
-            if ' and ' not in record['author'] and ',' in record['author']:
-                authors=[]
-                for author in record['author'].split(','):
-                    authors.append('{'+author.strip()+'}')
-                record['author'] = " and ".join(authors)
-        return self.__getuserinput(record)
+        return self.__finish(record)
+
+    def handle_records(self, records, jobs=1):
+        '''Handle a list of already parsed records, scoring their journals in one batch.
+
+        Every journal that has not been matched yet is settled by its
+        canonical form or else scored up front by JournalMatcher.matchmany.
+        With jobs > 1 the records are cleaned in a pool of jobs processes
+        while that runs; the pool also does the matching if there is no
+        batch scorer (see matcher.batchbackend). The prompts run afterwards,
+        one record at a time in the original order, so the result is the
+        same as calling handle_record on each record.
+        '''
+        unchanged = {id(record) for record in records if self.__unchanged(record)}
+        valid = [record for record in records
+                 if id(record) not in unchanged and self.__isvalid(record)]
+        journals = [record['journal'] for record in valid]
+        if jobs > 1:
+            # Only needed with --jobs and slow to import
+            from concurrent.futures import ProcessPoolExecutor  #pylint: disable=C0415
+            # A JournalTable is a few arrays, much cheaper to send to every worker than a dict
+            with PROFILER.stage('clean in pool'), \
+                 ProcessPoolExecutor(jobs, initializer=initworker,
+                                     initargs=(JournalTable(self.journals),)) as pool:
+                cleaned = pool.map(cleanrecord, valid, chunksize=max(1, len(valid) // (jobs*4)))
+                if batchbackend() is not None:
+                    self.prescore(journals)
+                else:
+                    pending = self.__resolve(journals)
+                    for journal, match in pool.map(matchjournal, pending,
+                                                   chunksize=max(1, len(pending) // (jobs*4))):
+                        self.prescored[journal] = match
+                cleaned = iter(list(cleaned))
+        else:
+            self.prescore(journals)
+            cleaned = iter([cleanrecord(record) for record in valid])
+        clean = []
+        for record in records:
+            if id(record) in unchanged:
+                clean.append(record)
+                continue
+            if not self.__isvalid(record):
+                clean.append(self.handle_record(record))
+                continue
+            record, _c = next(cleaned)
+            if _c:
+                self.stats['n_cleaned'] += 1
+            clean.append(self.__finish(record))
+        return clean
+
+    def prescore(self, journals):
+        '''Score every journal that has not been matched yet in one batch'''
+        pending = self.__resolve(journals)
+        if not pending:
+            return
+        if self.matcher is None:
+            self.matcher = JournalMatcher(self.journals)
+        with PROFILER.stage('batch match'):
+            self.prescored.update(self.matcher.matchmany(pending))
+
+    def __resolve(self, journals):
+        '''Settle the unscored journals that have a canonical match and return the rest'''
+        pending = []
+        with PROFILER.stage('canonical match'):
+            for journal in self.__unscored(journals):
+                abbrev = self.__canonicalmatch(journal)
+                if abbrev is None:
+                    pending.append(journal)
+                else:
+                    self.prescored[journal] = [abbrev, 1.0]
+                    self.stats['n_match_canonical'] += 1
+        return pending
+
+    def __canonicalmatch(self, journal):
+        '''Return the only abbreviation whose canonical form is that of journal, or None'''
+        if hasattr(self.journals, 'getcanonical'):
+            return self.journals.getcanonical(journal)
+        if self.canonical is None:
+            with PROFILER.stage('build canonical index'):
+                self.canonical = buildindex(self.journals.items())
+        return self.canonical.get(canonical(journal))
+
+    def __iscanonical(self, journal, abbrev):
+        '''Return True if abbrev is the canonical match of journal, which is not a known name'''
+        return journal != abbrev and journal not in self.journals \
+            and self.__canonicalmatch(journal) == abbrev
+
+    def __unscored(self, journals):
+        '''Return the distinct journals that have no answer or match result yet'''
+        return [journal for journal in dict.fromkeys(journals)
+                if journal not in self.history
+                and journal not in self.stored
+                and journal not in self.prescored]
+
+    def __unchanged(self, record):
+        '''Return True, and count it, if record is exactly as the last run wrote it'''
+        if not self.manifest or self.manifest.get(record.get('ID')) != entryhash(record):
+            return False
+        self.hashes[record['ID']] = self.manifest[record['ID']]
+        self.stats['n_skipped'] += 1
+        return True
+
+    def __finish(self, record):
+        '''Resolve the journal of a cleaned record and remember the hash of the result'''
+        journal = record['journal']
+        record = self.__getuserinput(record)
+        # An open question has to be asked again when the decisions are applied
+        if not self.decisions.pending(journal):
+            self.hashes[record['ID']] = entryhash(record)
+        return record
+
+    def __isvalid(self, record):
+        '''Return True if record has every field that handle_record needs'''
+        return all(key in record for key in RecordHandler.recordkeys)
 
     def __getuserinput(self, record):
         '''Determine if we need to ask the user for input and then do it.'''
-        fuzzy,score = self.__fuzzymatch(record['journal'])
-        __abbrev = False
         if record['journal'] in self.history:
             fuzzy = self.history[record['journal']]
             __abbrev = bool(fuzzy)
-        elif score > 0.95:
-            __abbrev = True
         else:
-            try:
-                _j = input('(%0.1f%%) Replace "%s%s%s" with "%s%s%s" or something else? ' % (
-                    score*100,Style.BRIGHT+Fore.YELLOW,
-                    record['journal'],Style.RESET_ALL,
-                    Style.BRIGHT+Fore.GREEN,
-                    fuzzy,Style.RESET_ALL))
-                if _j.lower() in ('y','yes'):
-                    __abbrev = True
-                elif _j.lower() in ('n','no',''):
-                    self.history[record['journal']] = None
-                elif _j:
-                    fuzzy = _j
-                    __abbrev = True
-            except KeyboardInterrupt:
-                print('')
-                sys.exit()
+            fuzzy,score = self.__fuzzymatch(record['journal'])
+            __abbrev = score > 0.95
+            if not __abbrev:
+                with PROFILER.stage('prompt'):
+                    decided = self.decisions.journal(record['journal'], fuzzy, score)
+                    if decided is False:
+                        self.history[record['journal']] = None
+                    elif decided:
+                        fuzzy = decided
+                        __abbrev = True
+                        self.history[record['journal']] = fuzzy
+                    else:
+                        try:
+                            _j = input('(%0.1f%%) Replace "%s%s%s" with "%s%s%s" or something else? ' % (
+                                score*100,Style.BRIGHT+Fore.YELLOW,
+                                record['journal'],Style.RESET_ALL,
+                                Style.BRIGHT+Fore.GREEN,
+                                fuzzy,Style.RESET_ALL))
+                            if _j.lower() in ('y','yes'):
+                                __abbrev = True
+                                self.history[record['journal']] = fuzzy
+                            elif _j.lower() in ('n','no',''):
+                                self.history[record['journal']] = None
+                            elif _j:
+                                fuzzy = _j
+                                __abbrev = True
+                                self.history[record['journal']] = fuzzy
+                        except KeyboardInterrupt:
+                            print('')
+                            sys.exit()
 
         if __abbrev and not record['journal'] == fuzzy:
-            self.history[record['journal']] = fuzzy
             print('%s%s%s%s -> %s%s%s' % (Style.BRIGHT,Fore.CYAN,record['journal'],
                 Fore.WHITE,Fore.CYAN,fuzzy,Style.RESET_ALL))
             self.stats['n_abbreviated'] += 1
             record['journal'] = fuzzy
-        record['journal'] = string_to_latex(record['journal'])
-        record = page_double_hyphen(record)
+        with PROFILER.stage('latex encode'):
+            record['journal'] = textnorm.tolatex(record['journal'])
+            record = page_double_hyphen(record)
         self.stats['n_parsed'] += 1
         return record
 
     def __fuzzymatch(self,journal):
         '''Private method to do a fuzzy match of journal names'''
-        i = ('',0)
-        for key in self.journals:
-            _a = Levenshtein.ratio(journal,key) #pylint: disable=E1101
-            _b = Levenshtein.ratio(journal,self.journals[key]) #pylint: disable=E1101
-            if _a > i[1]:
-                i = [self.journals[key],_a]
-            if _b > i[1]:
-                i = [self.journals[key],_b]
-        return i
+        if journal in self.seen:
+            self.stats['n_match_hits'] += 1
+            return self.stored[journal]
+        self.seen.add(journal)
+        if journal in self.stored:
+            self.stats['n_match_stored'] += 1
+        else:
+            self.stats['n_match_misses'] += 1
+            if journal not in self.prescored:
+                self.__resolve([journal])
+            if self.prescored.get(journal) is not None:
+                self.stored[journal] = self.prescored.pop(journal)
+            else:
+                if self.matcher is None:
+                    self.matcher = JournalMatcher(self.journals)
+                with PROFILER.stage('fuzzy match'):
+                    self.stored[journal] = self.matcher.match(journal)
+        return self.stored[journal]
+
+    def getmatches(self):
+        '''Return every match result scored or reused during this run'''
+        return self.stored
+
+    def gethashes(self):
+        '''Return the hashes of every entry handled, to be saved as the next manifest'''
+        return self.hashes
+
+    def getcounters(self):
+        '''Return the stats with matcher candidate counts and cache hit rates, for --profile'''
+        counters = dict(self.stats, n_failed=len(self.errors))
+        counters.update(textnorm.counters())
+        lookups = self.stats['n_match_hits'] + self.stats['n_match_stored'] \
+                  + self.stats['n_match_misses']
+        if lookups:
+            counters['match_hit_rate'] = self.stats['n_match_hits'] / lookups
+            counters['match_stored_rate'] = self.stats['n_match_stored'] / lookups
+        if self.matcher is not None:
+            counters['matcher_candidates'] = len(self.matcher)
+            counters.update(('matcher_'+_k, _v) for _k, _v in self.matcher.stats.items())
+            if self.matcher.stats['n_queries']:
+                counters['matcher_scored_per_query'] = \
+                    self.matcher.stats['n_scored'] / self.matcher.stats['n_queries']
+        return counters
 
     def getcustom(self):
-        '''Return any custom journal abbreviations entered during handle_record'''
+        '''Return any custom journal abbreviations entered during handle_record.
+
+        Answers that the journals already give, by name or by canonical form,
+        are left out: adding them would change the fingerprint of the journals
+        and with it throw away the match cache for nothing.
+        '''
         unique = []
         for key in self.history:
             if self.history[key] is None:
                 continue
-            if key not in self.journals:
+            if key not in self.journals and not self.__iscanonical(key, self.history[key]):
                 unique.append(";".join([key, self.history[key]]))
                 print("%sCaching %s%s ==> %s" % (
                     Style.BRIGHT+Fore.CYAN, Fore.WHITE,
@@ -168,10 +394,15 @@ class RecordHandler():
 
     def printstats(self):
         '''Print stats in pretty colors'''
+        print('%sSkipped (unchanged since last run): %s' % (Fore.BLUE,self.stats['n_skipped']))
         print('%s%sParsed: %s\n%sCleaned: %s\n%sAbbreviated: %s\n%sFailed:%s%s' % \
                 (Style.BRIGHT,Fore.GREEN,self.stats['n_parsed'],Fore.YELLOW,
                     self.stats['n_cleaned'],Fore.MAGENTA,self.stats['n_abbreviated'],
                     Fore.RED,len(self.errors),Style.RESET_ALL))
+        print('%sMatch cache: %s hits, %s from disk, %s misses (%s canonical)%s' % (Fore.BLUE,
+                    self.stats['n_match_hits'],self.stats['n_match_stored'],
+                    self.stats['n_match_misses'],self.stats['n_match_canonical'],
+                    Style.RESET_ALL))
         if self.errors:
             print('\nEntries that produced errors:\n')
             #print(self.errors)
@@ -179,6 +410,6 @@ class RecordHandler():
                 print('* * * * * * * * * * * * * * * *')
                 for key in RecordHandler.recordkeys:
                     if key not in err:
-                        print('%s%s%s: -' % (Fore.RED,titlecase(key),Style.RESET_ALL))
+                        print('%s%s%s: -' % (Fore.RED,textnorm.titlecase(key),Style.RESET_ALL))
                     else:
-                        print('%s: %s%s' % (titlecase(key),Style.BRIGHT,err[key]))
+                        print('%s: %s%s' % (textnorm.titlecase(key),Style.BRIGHT,err[key]))
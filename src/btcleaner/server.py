@@ -0,0 +1,97 @@
+'''Serve a warm Cleaner over HTTP on localhost so editors and CI can skip the startup cost'''
+import sys
+import json
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+try:
+    from colorama import Fore
+
+except ImportError as msg:
+    print("Error importing package: %s" % str(msg))
+    sys.exit(1)
+
+from .decisions import Decisions
+
+
+HOST = '127.0.0.1'
+PORT = 8765
+
+
+class CleanerRequestHandler(BaseHTTPRequestHandler):
+    '''Answer GET /ping and POST /clean with JSON.
+
+    The body of POST /clean is either BibTeX or a JSON object with
+    "bibtex", optional "decisions" (the contents of a reviewed decisions
+    file) and optional "dedupe" (default true). Nothing is ever asked:
+    the reply has the cleaned "bibtex", the open "questions" in the
+    layout of a decisions file and the "stats" of the clean.
+    '''
+
+    def do_GET(self): #pylint: disable=C0103
+        '''Report that the server is up and how many journals it has loaded'''
+        if self.path != '/ping':
+            self.send_error(404)
+            return
+        self.__reply(200, {'journals':len(self.server.cleaner.journals),
+                           'cleans':self.server.cleans})
+
+    def do_POST(self): #pylint: disable=C0103
+        '''Clean the BibTeX in the body of the request'''
+        if self.path != '/clean':
+            self.send_error(404)
+            return
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf8')
+        decisions = Decisions(batch=True)
+        dodedupe = True
+        if self.headers.get('Content-Type', '').startswith('application/json'):
+            try:
+                _req = json.loads(body)
+                body = _req['bibtex']
+            except (ValueError, KeyError, TypeError) as msg:
+                self.__reply(400, {'error':'Bad request: %s' % str(msg)})
+                return
+            if _req.get('decisions'):
+                decisions.update(_req['decisions'])
+            dodedupe = _req.get('dedupe', True)
+        bibtex, records = self.server.cleaner.cleanstring(body, decisions, dodedupe=dodedupe)
+        self.server.cleans += 1
+        self.__reply(200, {'bibtex':bibtex,
+                           'questions':decisions.questions(),
+                           'stats':dict(records.stats, n_failed=len(records.errors))})
+
+    def __reply(self, code, data):
+        '''Send data as a JSON response'''
+        _b = json.dumps(data, ensure_ascii=False).encode('utf8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(_b)))
+        self.end_headers()
+        self.wfile.write(_b)
+
+
+def serve(cleaner, host=HOST, port=PORT):
+    '''Serve cleaner until interrupted, then save its match results'''
+    httpd = HTTPServer((host, port), CleanerRequestHandler)
+    httpd.cleaner = cleaner.warm()
+    httpd.cleans = 0
+    print('%sServing %s journals on http://%s:%s/clean' % (
+        Fore.GREEN, len(cleaner.journals), host, httpd.server_address[1]))
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        print('')
+    finally:
+        httpd.server_close()
+        cleaner.save()
+
+def cleanremote(bibtex, decisions=None, host=HOST, port=PORT, dodedupe=True):
+    '''Send bibtex to a running server and return its reply as a dict'''
+    import urllib.request  #pylint: disable=C0415
+    _req = {'bibtex':bibtex, 'dedupe':dodedupe}
+    if decisions:
+        _req['decisions'] = decisions
+    _r = urllib.request.Request('http://%s:%s/clean' % (host, port),
+                                data=json.dumps(_req).encode('utf8'),
+                                headers={'Content-Type':'application/json'})
+    with urllib.request.urlopen(_r) as fh:
+        return json.loads(fh.read().decode('utf8'))
@@ -0,0 +1,156 @@
+'''Save a cleaned bib file by replacing only the entries that changed'''
+import sys
+import os
+import re
+import mmap
+import shutil
+import tempfile
+import contextlib
+
+try:
+    from bibtexparser.bwriter import BibTexWriter
+    from bibtexparser.bibdatabase import BibDatabase
+    from colorama import Fore
+
+except ImportError as msg:
+    print("Error importing package: %s" % str(msg))
+    sys.exit(1)
+
+from .stream import itemparser, parseitem
+from .recordhandler import entryhash
+from .profiler import PROFILER
+
+# The start of a BibTeX item, as in stream.ITEMSTART but in bytes
+ITEMSTART = re.compile(rb'@\s*([\w-]+)\s*([{(])')
+# The delimiters that matter inside an item opened by { or by (
+BRACES = re.compile(rb'[{}]')
+PARENS = re.compile(rb'[{})]')
+WHITESPACE = b' \t\r\n'
+
+
+def iterspans(data):
+    '''Yield (item type, start, end) of every @item in data, a bytes-like object'''
+    pos = 0
+    while True:
+        at = data.find(b'@', pos)
+        if at < 0:
+            return
+        _m = ITEMSTART.match(data, at)
+        if _m is None:
+            # A stray @, e.g. in an e-mail address in a comment
+            pos = at+1
+            continue
+        end = closing(data, _m.end(), _m.group(2))
+        if end < 0:
+            # An item that is never closed is left alone with the rest of the file
+            return
+        yield _m.group(1).decode('ascii').lower(), at, end
+        pos = end
+
+def closing(data, start, delim):
+    '''Return the offset just past the delimiter closing the item at start, or -1'''
+    depth = 0
+    for _m in (BRACES if delim == b'{' else PARENS).finditer(data, start):
+        _c = _m.group()
+        if _c == b'{':
+            depth += 1
+        elif _c == b'}':
+            if depth == 0 and delim == b'{':
+                return _m.end()
+            depth -= 1
+        elif depth == 0:
+            return _m.end()
+    return -1
+
+@contextlib.contextmanager
+def mapfile(path):
+    '''Map a file into memory read-only; an empty file is b'' since it cannot be mapped'''
+    with open(path, 'rb') as fh:
+        if not os.fstat(fh.fileno()).st_size:
+            yield b''
+            return
+        with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            yield data
+
+
+class BibFile():
+    '''The entries of a bib file and where each one is in the file.
+
+    Every @item is found by scanning the memory-mapped file and parsed on
+    its own, so the byte span and a hash of every entry are known. write()
+    then copies everything that was not changed straight from the original
+    file: comments, @string and @preamble items, spacing and unchanged
+    entries are kept byte for byte and in their order, only entries that
+    were changed are written in bibtexparser's format, and dropped entries
+    are cut out. A BibFile can be pickled, e.g. to be parsed in a worker.
+    '''
+
+    def __init__(self, bibfile):
+        self.path = os.path.abspath(bibfile)
+        # Parsed entries, their (start, end) byte offsets and their hashes as parsed
+        self.entries = []
+        self.spans = []
+        self.hashes = []
+        _st = os.stat(self.path)
+        self.stamp = (_st.st_size, _st.st_mtime_ns)
+        parser = itemparser()
+        with mapfile(self.path) as data:
+            for itemtype, start, end in iterspans(data):
+                entries = parseitem(parser, itemtype, data[start:end].decode('utf8'))
+                if itemtype == 'string' or len(entries) != 1:
+                    continue
+                self.entries.append(entries[0])
+                self.spans.append((start, end))
+                self.hashes.append(entryhash(entries[0]))
+        self.strings = parser.bib_database.strings
+
+    def database(self):
+        '''Return a BibDatabase of the entries, e.g. to dedupe them'''
+        bib_database = BibDatabase()
+        bib_database.entries = list(self.entries)
+        bib_database.strings = self.strings
+        return bib_database
+
+    def write(self, kept=None, path=None):
+        '''Write the file to path (default: over itself) with only changed entries replaced.
+
+        self.entries must still line up with the entries as parsed, e.g.
+        after self.entries = records.handle_records(self.entries); kept is
+        what is left of them after deduping (default: all of them). Returns
+        False, without writing, if the file changed on disk since it was
+        parsed.
+        '''
+        path = os.path.abspath(path or self.path)
+        _st = os.stat(self.path)
+        if (_st.st_size, _st.st_mtime_ns) != self.stamp:
+            print('%s%s changed on disk since it was read; not saving.' % (Fore.RED, self.path))
+            return False
+        keep = {id(_e) for _e in (self.entries if kept is None else kept)}
+        writer = BibTexWriter()
+        writer.contents = ['entries']
+        n_changed, n_dropped = 0, 0
+        out = tempfile.NamedTemporaryFile(dir=os.path.dirname(path), delete=False,
+                prefix='.'+os.path.basename(path)+'.', suffix='.tmp')
+        with out, mapfile(self.path) as data, PROFILER.stage('write'):
+            pos = 0
+            for record, (start, end), _h in zip(self.entries, self.spans, self.hashes):
+                if id(record) not in keep:
+                    out.write(data[pos:start])
+                    # Take the space after a dropped entry with it
+                    while end < len(data) and data[end:end+1] in WHITESPACE:
+                        end += 1
+                    pos = end
+                    n_dropped += 1
+                elif entryhash(record) != _h:
+                    single = BibDatabase()
+                    single.entries = [record]
+                    out.write(data[pos:start])
+                    out.write(writer.write(single).strip().encode('utf8'))
+                    pos = end
+                    n_changed += 1
+            out.write(data[pos:])
+        shutil.copymode(self.path, out.name)
+        os.replace(out.name, path)
+        print('%sRewrote %s changed entries and dropped %s; %s were left as they were.' % (
+            Fore.YELLOW, n_changed, n_dropped, len(self.entries) - n_changed - n_dropped))
+        return True
@@ -0,0 +1,174 @@
+'''Clean a bib file entry by entry without holding the whole database in memory'''
+import sys
+import os
+import re
+import shutil
+import tempfile
+
+try:
+    from bibtexparser.bparser import BibTexParser
+    from bibtexparser.bwriter import BibTexWriter
+    from bibtexparser.bibdatabase import BibDatabase
+    from colorama import Fore
+
+except ImportError as msg:
+    print("Error importing package: %s" % str(msg))
+    sys.exit(1)
+
+from . import dedupe
+from .profiler import PROFILER
+
+# Characters read from the bib file at a time
+CHUNKSIZE = 1 << 16
+# The start of a BibTeX item: @type followed by its opening delimiter
+ITEMSTART = re.compile(r'@\s*([\w-]+)\s*([{(])')
+# The only fields dedupe needs; nothing else is kept for the dedupe index
+DEDUPEFIELDS = ('ENTRYTYPE', 'ID', 'title', 'author', 'year', 'doi', 'journal', 'volume', 'pages')
+
+
+def iterblocks(fh):
+    '''Yield ('item', text) for each @item in fh and ('raw', text) for what lies between.
+
+    The file is read in chunks of CHUNKSIZE characters and an item is yielded
+    as soon as its closing brace (or parenthesis) has been read.
+    '''
+    buf = ''
+    eof = False
+    while not eof:
+        chunk = fh.read(CHUNKSIZE)
+        eof = not chunk
+        buf += chunk
+        pos = search = 0
+        while True:
+            at = buf.find('@', search)
+            if at < 0:
+                break
+            _m = ITEMSTART.match(buf, at)
+            if _m is None:
+                if not eof and len(buf) - at < 256:
+                    # The rest of the item header has not been read yet
+                    break
+                # A stray @, e.g. in an e-mail address in a comment
+                search = at+1
+                continue
+            end = __closing(buf, _m.end(), _m.group(2))
+            if end < 0:
+                # Read more of the item, or at the end of the file give up on it
+                break
+            if buf[pos:at].strip():
+                yield 'raw', buf[pos:at]
+            yield 'item', buf[at:end]
+            pos = search = end
+        buf = buf[pos:]
+    if buf.strip():
+        yield 'raw', buf
+
+def __closing(buf, start, delim):
+    '''Return the index just past the delimiter closing the item at start, or -1'''
+    depth = 0
+    close = '}' if delim == '{' else ')'
+    for i in range(start, len(buf)):
+        _c = buf[i]
+        if _c == '{':
+            depth += 1
+        elif _c == '}':
+            if depth == 0 and close == '}':
+                return i+1
+            depth -= 1
+        elif _c == close and depth == 0:
+            return i+1
+    return -1
+
+def itemparser():
+    '''Return a BibTexParser for parsing a file one item at a time with parseitem()'''
+    parser = BibTexParser(common_strings=True)
+    parser.expect_multiple_parse = True
+    return parser
+
+def parseitem(parser, itemtype, text):
+    '''Parse the text of one @item and return its entries.
+
+    @string macros are remembered by parser, so they are still expanded in
+    later entries; @comment and @preamble items are not parsed.
+    '''
+    if itemtype in ('comment', 'preamble'):
+        return []
+    parser.parse(text, partial=True)
+    entries, parser.bib_database.entries = parser.bib_database.entries, []
+    return entries
+
+def iterrecords(fh):
+    '''Yield ('entry', record) for each entry in fh and ('raw', text) for everything else.
+
+    Each item is parsed on its own by one BibTexParser, so @string macros
+    defined earlier in the file are still expanded in later entries.
+    '''
+    parser = itemparser()
+    for kind, text in iterblocks(fh):
+        itemtype = ITEMSTART.match(text).group(1).lower() if kind == 'item' else ''
+        # A @string definition is written back as it was
+        entries = parseitem(parser, itemtype, text) if itemtype else []
+        if itemtype != 'string' and entries:
+            for record in entries:
+                yield 'entry', record
+            continue
+        yield 'raw', text
+
+def cleanstream(bibfile, records, decisions=None):
+    '''Clean bibfile through records.handle_record into a temporary file.
+
+    Entries are read, cleaned and written one at a time; only the fields
+    dedupe needs are kept in memory. Duplicates are then resolved and
+    dropped while copying to a second temporary file next to bibfile, whose
+    name is returned so the caller can os.replace() it over bibfile.
+    Entries keep their order in the file.
+    '''
+    writer = BibTexWriter()
+    writer.contents = ['entries']
+    index = BibDatabase()
+    spans = []
+    dirname = os.path.dirname(os.path.abspath(bibfile))
+    with open(bibfile, encoding='utf8') as fh, \
+         tempfile.TemporaryFile(dir=dirname) as cleaned:
+        # The self time of parse leaves out the cleaning and writing timed inside it
+        with PROFILER.stage('parse'):
+            for kind, item in iterrecords(fh):
+                if kind == 'entry':
+                    record = records.handle_record(item)
+                    single = BibDatabase()
+                    single.entries = [record]
+                    with PROFILER.stage('write'):
+                        text = writer.write(single)
+                    stub = {_f:record[_f] for _f in DEDUPEFIELDS if _f in record}
+                    if 'author' in stub:
+                        stub['author'] = stub['author'].split(' and ')[0]
+                    index.entries.append(stub)
+                    start = cleaned.tell()
+                    cleaned.write((text + '\n').encode('utf8'))
+                    spans.append((start, cleaned.tell()))
+                else:
+                    cleaned.write((item.strip() + '\n\n').encode('utf8'))
+        keep = {id(_e) for _e in dedupe.dodupecheck(index, decisions)}
+        drop = [spans[i] for i, _e in enumerate(index.entries) if id(_e) not in keep]
+        print('%sDropping %s duplicate entries.' % (Fore.YELLOW, len(drop)))
+        cleaned.seek(0)
+        out = tempfile.NamedTemporaryFile(dir=dirname, delete=False,
+                prefix='.'+os.path.basename(bibfile)+'.', suffix='.tmp')
+        with out, PROFILER.stage('write'):
+            pos = 0
+            for start, end in drop:
+                __copy(cleaned, out, start - pos)
+                cleaned.seek(end)
+                pos = end
+            __copy(cleaned, out, -1)
+    shutil.copymode(bibfile, out.name)
+    return out.name
+
+def __copy(src, dst, size):
+    '''Copy size bytes (or everything if size < 0) from src to dst in chunks'''
+    while size:
+        chunk = src.read(CHUNKSIZE if size < 0 else min(size, CHUNKSIZE))
+        if not chunk:
+            return
+        dst.write(chunk)
+        size -= len(chunk)
@@ -0,0 +1,102 @@
+'''Memoized text transforms shared by the cleaner and BibtoHTML.
+
+Journals, volumes, years and author lists repeat a lot within and across
+bib files, so each transform keeps a bounded LRU cache of its results.
+Strings that are plain ASCII with nothing to convert skip the transform
+(and the cache) altogether.
+'''
+import sys
+import re
+from collections import OrderedDict
+
+try:
+    from titlecase import titlecase as __titlecase
+    from bibtexparser.latexenc import string_to_latex as __string_to_latex
+
+except ImportError as msg:
+    print("Error importing package: %s" % str(msg))
+    sys.exit(1)
+
+# ASCII characters that string_to_latex escapes
+LATEXSPECIAL = re.compile(r"[#$%&'*\\^_`|~]")
+# ASCII that the latex codec changes: commands, ties, comments, quotes,
+# dashes, ligatures and whitespace other than single spaces
+LATEXMARKUP = re.compile(r"[\\~%`]|[^\S ]|,,|''|--|  ")
+
+
+class Memo():
+    '''A bounded LRU cache of the results of a function of one string'''
+
+    def __init__(self, func, maxsize):
+        self.func = func
+        self.maxsize = maxsize
+        self.cache = OrderedDict()
+        self.stats = {'n_hits':0, 'n_misses':0, 'n_fast':0}
+
+    def __call__(self, text):
+        if text in self.cache:
+            self.stats['n_hits'] += 1
+            self.cache.move_to_end(text)
+            return self.cache[text]
+        self.stats['n_misses'] += 1
+        result = self.func(text)
+        self.cache[text] = result
+        if len(self.cache) > self.maxsize:
+            self.cache.popitem(last=False)
+        return result
+
+    def clear(self):
+        '''Forget every result'''
+        self.cache.clear()
+
+
+def __unbrace(text):
+    '''Remove braces and shorten dashes, the first step of cleanlatex'''
+    for _r in (('{',''),('}',''),('--','-')):
+        text = text.replace(_r[0],_r[1])
+    return text
+
+def __cleanlatex(text):
+    '''Turn LaTeX into plain text, as BibtoHTML shows it'''
+    # Registers the latex codec; only BibtoHTML needs it
+    import latexcodec  #pylint: disable=C0415,W0611
+    return bytes(__unbrace(text), encoding='utf8').decode('latex').strip()
+
+TITLECASE = Memo(__titlecase, 8192)
+TOLATEX = Memo(__string_to_latex, 4096)
+CLEANLATEX = Memo(__cleanlatex, 8192)
+
+def titlecase(text):
+    '''Return titlecase.titlecase(text), remembering recent results'''
+    if not text:
+        TITLECASE.stats['n_fast'] += 1
+        return text
+    return TITLECASE(text)
+
+def tolatex(text):
+    '''Return bibtexparser's string_to_latex(text), remembering recent results'''
+    if text.isascii() and not LATEXSPECIAL.search(text):
+        TOLATEX.stats['n_fast'] += 1
+        return text
+    return TOLATEX(text)
+
+def cleanlatex(text):
+    '''Return text without braces and with LaTeX decoded, remembering recent results'''
+    if text.isascii():
+        plain = __unbrace(text)
+        if not LATEXMARKUP.search(plain):
+            CLEANLATEX.stats['n_fast'] += 1
+            return plain.strip()
+    return CLEANLATEX(text)
+
+def clear():
+    '''Forget every remembered result, e.g. between benchmark runs'''
+    for _m in (TITLECASE, TOLATEX, CLEANLATEX):
+        _m.clear()
+
+def counters():
+    '''Return the hits, misses and fast paths of every transform, for --profile'''
+    return {'%s_%s' % (_n, _k[2:]): _v
+            for _n, _m in (('titlecase', TITLECASE), ('tolatex', TOLATEX),
+                           ('cleanlatex', CLEANLATEX))
+            for _k, _v in _m.stats.items()}
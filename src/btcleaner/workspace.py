@@ -0,0 +1,176 @@
+'''Clean every bib file of a directory or glob with one Cleaner and one dedupe index'''
+import sys
+import os
+import glob
+import shutil
+
+try:
+    from colorama import Fore,Style
+
+except ImportError as msg:
+    print("Error importing package: %s" % str(msg))
+    sys.exit(1)
+
+from . import cache, dedupe
+from .decisions import Decisions
+from .profiler import PROFILER
+from .splice import BibFile
+
+
+def isworkspace(infile):
+    '''Return True if infile names a directory or a glob rather than one file'''
+    if os.path.isfile(infile):
+        return False
+    return os.path.isdir(infile) or any(_c in infile for _c in '*?[')
+
+def findbibfiles(pattern):
+    '''Return the bib files under a directory, or matching a glob, sorted'''
+    if os.path.isdir(pattern):
+        pattern = os.path.join(pattern, '**', '*.bib')
+    return sorted(os.path.abspath(_f) for _f in glob.glob(pattern, recursive=True)
+                  if os.path.isfile(_f))
+
+def writefile(source, kept):
+    '''Write the changed entries of one bib file, in a worker process when there are jobs'''
+    # source and kept are pickled together, so the entries in kept are still those in source
+    return source.write(kept)
+
+
+class Workspace():
+    '''A set of bib files cleaned together with the journals of one Cleaner.
+
+    With jobs > 1 the files are parsed, and later written, that many at a
+    time in worker processes, and the entries of each file are cleaned and
+    matched in jobs processes as they are for a single file. Questions are
+    asked one file at a time, in order, and an answer given for one file
+    holds for all of them. Duplicates within a file are resolved as they are for a
+    single file; then one index of every entry finds the duplicates that
+    span files, which are reported with the file each copy is in but not
+    removed, since every file may need its own copy.
+    '''
+
+    def __init__(self, cleaner, bibfiles, decisions=None, full=False):
+        self.cleaner = cleaner
+        self.bibfiles = list(bibfiles)
+        self.decisions = decisions if decisions is not None else Decisions()
+        # Clean every entry instead of skipping those unchanged since the last run
+        self.full = full
+        self.root = os.path.commonpath([os.path.dirname(_f) for _f in self.bibfiles])
+        self.sources = []
+        self.databases = []
+        self.records = []
+        # Answers to journal questions, shared by the RecordHandler of every file
+        self.history = {}
+
+    def clean(self, jobs=1, dodedupe=True):
+        '''Back up, parse, clean and dedupe every file; return the duplicates across files'''
+        print('%sBacking up %s files in %s' % (Fore.YELLOW, len(self.bibfiles), self.root))
+        for bibfile in self.bibfiles:
+            shutil.copy2(bibfile, bibfile+'.bak')
+        with PROFILER.stage('parse'):
+            self.sources = self.__map(BibFile, jobs, self.bibfiles)
+        self.databases = []
+        for bibfile, source in zip(self.bibfiles, self.sources):
+            print('\n%s # # # # %s%s' % (Style.BRIGHT, self.relpath(bibfile), Style.RESET_ALL))
+            manifest = {}
+            if not self.full:
+                manifest = cache.getmanifest(bibfile, self.cleaner.journals)
+            records = self.cleaner.getrecordhandler(self.decisions, manifest)
+            records.history = self.history
+            source.entries = records.handle_records(source.entries, jobs)
+            bib_database = source.database()
+            # Keep the matcher if the handler had to build it
+            self.cleaner.matcher = records.matcher
+            if dodedupe:
+                bib_database.entries = dedupe.dodupecheck(bib_database, self.decisions)
+            self.databases.append(bib_database)
+            self.records.append(records)
+        if not dodedupe:
+            return []
+        groups = self.crossfile()
+        self.printcrossfile(groups)
+        return groups
+
+    def crossfile(self):
+        '''Return the groups of duplicates in more than one file as (bibfile, entry) pairs'''
+        entries, origins = [], {}
+        for bibfile, bib_database in zip(self.bibfiles, self.databases):
+            for record in bib_database.entries:
+                entries.append(record)
+                origins[id(record)] = bibfile
+        with PROFILER.stage('dedupe'):
+            groups = dedupe.mergegroups(entries, dedupe.findgroups(entries),
+                                        dedupe.findfuzzygroups(entries))
+        return [[(origins[id(_e)], _e) for _e in group] for group in groups
+                if len({origins[id(_e)] for _e in group}) > 1]
+
+    def printcrossfile(self, groups):
+        '''List duplicates across files with the file each copy is in'''
+        if not groups:
+            return
+        print('\n%sDuplicates across files (kept in every file):\n' % Style.BRIGHT)
+        for group in groups:
+            print('\t\t# # #')
+            for bibfile, record in group:
+                print('%s%s%s: %s%s' % (Style.BRIGHT, Fore.YELLOW, self.relpath(bibfile),
+                                        Fore.CYAN, record['ID']))
+                print('%sTitle: %s%s%s' % (Fore.YELLOW, Style.BRIGHT, Fore.WHITE,
+                                           record.get('title', '-')))
+                print('%sDOI: %s%s%s' % (Fore.YELLOW, Style.BRIGHT, Fore.WHITE,
+                                         record.get('doi', '-')), end='\n\n')
+
+    def write(self, jobs=1):
+        '''Write the changed entries of every file and remember its entries for the next run'''
+        print('%sSaving changes to %s files in %s' % (Style.BRIGHT+Fore.GREEN,
+                                                       len(self.bibfiles), self.root))
+        with PROFILER.stage('write'):
+            written = self.__map(writefile, jobs, self.sources,
+                                 [_db.entries for _db in self.databases])
+        with PROFILER.stage('save cache'):
+            for bibfile, records, _w in zip(self.bibfiles, self.records, written):
+                if _w:
+                    cache.putmanifest(bibfile, records.gethashes(), self.cleaner.journals)
+
+    def relpath(self, bibfile):
+        '''Return the name of bibfile relative to the root of the workspace'''
+        return os.path.relpath(bibfile, self.root)
+
+    def getcounters(self):
+        '''Return the counts of every file added up, for --profile'''
+        counters = {'n_files':len(self.bibfiles)}
+        for records in self.records:
+            for _k, _v in records.getcounters().items():
+                if _k.startswith('n_'):
+                    counters[_k] = counters.get(_k, 0) + _v
+                elif _k.startswith('matcher_'):
+                    # The matcher is shared, so its counts are already totals
+                    counters[_k] = _v
+        return counters
+
+    def printstats(self):
+        '''Print the stats of every file and their totals in pretty colors'''
+        for bibfile, records in zip(self.bibfiles, self.records):
+            print('%s%s: %sparsed %s, %scleaned %s, %sabbreviated %s, %sskipped %s, %sfailed %s' % (
+                Style.BRIGHT+Fore.WHITE, self.relpath(bibfile), Fore.GREEN,
+                records.stats['n_parsed'], Fore.YELLOW, records.stats['n_cleaned'],
+                Fore.MAGENTA, records.stats['n_abbreviated'], Fore.BLUE,
+                records.stats['n_skipped'], Fore.RED, len(records.errors)))
+        counters = self.getcounters()
+        print('%s%sTotal: %s files, parsed %s, cleaned %s, abbreviated %s, failed %s%s' % (
+            Style.BRIGHT, Fore.GREEN, counters['n_files'], counters.get('n_parsed', 0),
+            counters.get('n_cleaned', 0), counters.get('n_abbreviated', 0),
+            counters.get('n_failed', 0), Style.RESET_ALL))
+        print('%sMatch cache: %s hits, %s from disk, %s misses (%s canonical)%s' % (Fore.BLUE,
+            counters.get('n_match_hits', 0), counters.get('n_match_stored', 0),
+            counters.get('n_match_misses', 0), counters.get('n_match_canonical', 0),
+            Style.RESET_ALL))
+
+    @staticmethod
+    def __map(func, jobs, *iterables):
+        '''Return list(map(func, *iterables)), in jobs worker processes if jobs > 1'''
+        if jobs > 1 and len(iterables[0]) > 1:
+            # Only needed with --jobs and slow to import
+            from concurrent.futures import ProcessPoolExecutor  #pylint: disable=C0415
+            with ProcessPoolExecutor(min(jobs, len(iterables[0]))) as pool:
+                return list(pool.map(func, *iterables))
+        return list(map(func, *iterables))